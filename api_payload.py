@@ -0,0 +1,56 @@
+# api_payload.py
+
+# Поля товара, доступные через fields=
+PRODUCT_FIELDS = (
+    'id', 'product_id', 'model', 'short_model', 'price', 'formatted_price', 'currency', 'old_price',
+    'current_color', 'current_memory', 'current_sim', 'colors_list', 'memory_list', 'sim_options',
+    'all_colors', 'all_memory', 'image_url', 'product_url', 'category', 'is_featured', 'display_order',
+    'similar_ids', 'parsed_at', 'created_at',
+)
+
+# Поля ответа без fields= - те же, что отдавал /api/products до появления fields=:
+# колонки iphones_catalog и поля для отображения, без служебных search_text, colors,
+# memory_sizes и без similar_ids и sim_options, которые запрашиваются явно
+DEFAULT_FIELDS = tuple(field for field in PRODUCT_FIELDS if field not in ('similar_ids', 'sim_options'))
+
+# Готовые наборы полей
+FIELD_PRESETS = {
+    # Сетка каталога: название, цена, картинка
+    'grid': ('product_id', 'short_model', 'price', 'formatted_price', 'image_url', 'category', 'colors_list'),
+}
+
+FORMATS = ('rows', 'columns')
+
+
+def parse_fields(value):
+    """Кортеж полей из параметра fields= (None - поля по умолчанию); ValueError для неизвестных"""
+    if not value:
+        return None
+    if value in FIELD_PRESETS:
+        return FIELD_PRESETS[value]
+    fields = tuple(dict.fromkeys(field.strip() for field in value.split(',') if field.strip()))
+    unknown = [field for field in fields if field not in PRODUCT_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return fields or None
+
+
+def parse_format(value):
+    value = value or 'rows'
+    if value not in FORMATS:
+        raise ValueError(f"Unknown format: {value}")
+    return value
+
+
+def shape_products(products, fields=None, fmt='rows'):
+    """Товары в виде массива объектов или, для fmt='columns', массивов по полям"""
+    if fields is None:
+        fields = DEFAULT_FIELDS
+
+    if fmt == 'columns':
+        return {
+            'count': len(products),
+            'fields': list(fields),
+            'columns': {field: [product.get(field) for product in products] for field in fields},
+        }
+    return [{field: product.get(field) for field in fields} for product in products]
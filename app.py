@@ -1,38 +1,48 @@
 # app.py
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash
-import psycopg2
-import json
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash, g
 from datetime import datetime
 import os
+import time
+import uuid
 import logging
-from coinbase_commerce.client import Client
-from coinbase_commerce.webhook import Webhook
-from web_db_setup import setup_database
-from parsing import main_catalog
+from db_pool import ConnectionPool
+from catalog_facets import FACETS, FacetIndex, facet_filters_sql, filters_key, parse_facet_filters, with_price_range
+from catalog_search import normalize_query, tokenize
+from catalog_pagination import (
+    OFFSET_SORTS, cursor_values, decode_cursor, encode_cursor, keyset_sql, order_by_sql, resolve_sort,
+)
+from catalog_snapshot import CatalogSnapshotStore, COUNTS_QUERY, PRODUCTS_QUERY, format_product
+from http_cache import (
+    API, CACHE_POLICIES, NO_STORE, PAGE, STATIC, STATIC_CACHE_CONTROL, PrivateCookieSessionInterface, StaticVersions,
+    api_cache_control, is_not_modified, make_etag, to_utc,
+)
+import fast_json
+from api_payload import parse_fields, parse_format, shape_products
+from webhook_events import status_rank
+from webhook_queue import WebhookWorkerPool, enqueue
+from order_status_feed import RESYNC, OrderStatusFeed, retry_field, status_event
+from cart_store import cart_key_for, cart_store_from_env
+from telegram_auth import verify_init_data
+from payments import (
+    RESERVE_ORDER_ID_QUERY, cart_charge_info, price_cart, product_charge_info, product_line, save_order,
+)
+from fragment_cache import CART_BADGE_MARKER, FLASHES_MARKER, FragmentCache
 from dotenv import load_dotenv
 
 load_dotenv()
 
-def create_app():
+def create_app(db_pool=None):
     app = Flask(__name__)
 
-    with app.app_context():
-        try:
-            print(" Auto-initializing the database...")
-            from web_db_setup import setup_database
-            from parsing import main_catalog
-            setup_database()
-            print("✅ Database tables created")
-            main_catalog()
-            print("✅ Catalog data loaded")
-        except Exception as e:
-            print(f"⚠ Database initialization warning: {e}")
-
     # Set up logging to standard output
     logging.basicConfig(level=logging.DEBUG)
 
     # It's better to load the secret key from an environment variable for security
     app.config['SECRET_KEY'] = os.environ.get('FLASK_SECRET_KEY', 'your_secret_key') 
+    # The session cookie (cart_id / tg_user_id) is sent only when it changes,
+    # never on every response of a returning visitor
+    app.config['SESSION_REFRESH_EACH_REQUEST'] = False
+    app.session_interface = PrivateCookieSessionInterface()
 
     # --- Coinbase Commerce Setup ---
     # Load API key from environment variable
@@ -40,33 +50,61 @@ def create_app():
     # Load webhook secret from environment variable
     COINBASE_WEBHOOK_SECRET = os.environ.get('COINBASE_WEBHOOK_SECRET')
 
-    # Initialize the client if the API key is available
-    if COINBASE_API_KEY:
-        client = Client(api_key=COINBASE_API_KEY)
-    else:
-        client = None
+    # The client (and the requests stack behind it) is imported on the first
+    # payment, not at startup: most cold starts never reach a payment route
+    coinbase = {}
+
+    def get_coinbase_client():
+        if 'client' not in coinbase:
+            from coinbase_client import CommerceClient
+            coinbase['client'] = CommerceClient.from_env()
+        return coinbase['client']
+
+    if not COINBASE_API_KEY:
         print("Warning: COINBASE_COMMERCE_API_KEY environment variable not set. Crypto payments will be disabled.")
     # --- End of Coinbase Setup ---
 
+    # --- Database connection pool ---
+    # One pool per worker process, shared by the catalog and all order routes.
+    # asgi.py passes its own, sized to leave room for the asyncpg pool.
+    if db_pool is None:
+        db_pool = ConnectionPool.from_env()
+    app.config['DB_POOL_MIN'] = db_pool.minconn
+    app.config['DB_POOL_MAX'] = db_pool.maxconn
+    app.config['DB_POOL_TIMEOUT'] = db_pool.timeout
+    app.extensions['db_pool'] = db_pool
+
+    # Minimal startup for serverless cold starts (Vercel sets VERCEL=1):
+    # nothing touches the database until the first request needs it
+    app.config['MINIMAL_STARTUP'] = os.environ.get('MINIMAL_STARTUP', '1' if os.environ.get('VERCEL') else '0') == '1'
+
+    # Schema migration and catalog ingest run once per deploy (migrate.py);
+    # workers only check that the database matches this code.
+    if not app.config['MINIMAL_STARTUP']:
+        from web_db_setup import check_schema_version
+        try:
+            with db_pool.cursor() as cursor:
+                app.config['SCHEMA_VERSION'] = check_schema_version(cursor)
+        except Exception as e:
+            print(f"⚠ Database schema check warning: {e}")
+
     class iPhoneCatalog:
-        def __init__(self):
-                    self.db_url = os.environ.get('DATABASE_URL')
+        def __init__(self, db_pool, snapshot_store=None):
+            self.db_pool = db_pool
+            self.snapshot_store = snapshot_store
+
+        def _snapshot(self):
+            """Текущий снимок каталога или None, если читаем напрямую из базы"""
+            if self.snapshot_store is None:
+                return None
+            try:
+                return self.snapshot_store.get()
+            except Exception as e:
+                app.logger.warning(f"Catalog snapshot unavailable, falling back to SQL: {e}")
+                return None
         
-        def get_all_products(self, category=None, sort_by='price_desc', search=None):
-            """╨Я╨╛╨╗╤Г╤З╨╡╨╜╨╕╨╡ ╨▓╤Б╨╡╤Е ╤В╨╛_x000B_╨░╤А╨╛╨▓ ╤Б ╤Д╨╕╨╗╤М╤В╤А╨░╤Ж╨╕╨╡╨╣"""
-            conn = psycopg2.connect(self.db_url)
-            cursor = conn.cursor()
-            
-            # Базовый запрос
-            query = '''
-                SELECT ic.*, 
-                       STRING_AGG(DISTINCT icc.color_name, ',') as all_colors,
-                       STRING_AGG(DISTINCT icm.memory_size, ',') as all_memory
-                FROM iphones_catalog ic
-                LEFT JOIN iphone_catalog_colors icc ON ic.product_id = icc.product_id
-                LEFT JOIN iphone_catalog_memory icm ON ic.product_id = icm.product_id
-            '''
-            
+        def _filters(self, category=None, search=None, filters=None):
+            """Условия WHERE для фильтров каталога"""
             conditions = []
             params = []
             
@@ -74,121 +112,273 @@ def create_app():
             if category and category != 'all':
                 conditions.append("ic.category = %s")
                 params.append(category)
+
+            # Фасеты (цвет, память, SIM, цена)
+            facet_conditions, facet_params = facet_filters_sql(filters)
+            conditions.extend(facet_conditions)
+            params.extend(facet_params)
             
-            # Поиск
-            if search:
-                conditions.append("(ic.model ILIKE %s OR ic.current_color ILIKE %s)")
-                params.extend([f'%{search}%', f'%{search}%'])
+            # Поиск по нормализованной строке (триграммный индекс)
+            search_tokens = tokenize(search) if search else []
+            for token in search_tokens:
+                conditions.append("ic.search_text LIKE %s")
+                params.append(f'%{token}%')
+
+            return conditions, params, search_tokens
+
+        def _query_products(self, category=None, sort_by='price_desc', search=None, limit=None, after=None, offset=None, filters=None):
+            """Выборка товаров из базы (без снимка)"""
+            sort_by = resolve_sort(sort_by)
+
+            # Базовый запрос: цвета и память уже лежат в массивах строки
+            query = PRODUCTS_QUERY
+            conditions, params, search_tokens = self._filters(category, search, filters)
+
+            # Продолжение после курсора
+            if after is not None:
+                condition, condition_params = keyset_sql(sort_by, after)
+                conditions.append(condition)
+                params.extend(condition_params)
             
             if conditions:
                 query += " WHERE " + " AND ".join(conditions)
             
-            # Группировка
-            query += " GROUP BY ic.id"
-            
             # Сортировка
-            if sort_by == 'price_asc':
-                query += " ORDER BY ic.price ASC"
-            elif sort_by == 'price_desc':
-                query += " ORDER BY ic.price DESC"
-            elif sort_by == 'name':
-                query += " ORDER BY ic.model ASC"
+            if sort_by in OFFSET_SORTS:
+                if search_tokens:
+                    query += " ORDER BY similarity(ic.search_text, %s) DESC, ic.display_order ASC, ic.id ASC"
+                    params.append(' '.join(search_tokens))
+                else:
+                    query += order_by_sql('display_order')
             else:
-                query += " ORDER BY ic.display_order ASC"
+                query += order_by_sql(sort_by)
+
+            if limit is not None:
+                query += " LIMIT %s"
+                params.append(limit)
+            if offset:
+                query += " OFFSET %s"
+                params.append(offset)
             
-            cursor.execute(query, params)
-            products = [dict(zip([column[0] for column in cursor.description], row)) for row in cursor.fetchall()]
+            with self.db_pool.cursor() as cursor:
+                cursor.execute(query, params)
+                products = [dict(zip([column[0] for column in cursor.description], row)) for row in cursor.fetchall()]
             
             # Форматируем данные для отображения
-            for product in products:
-                product['formatted_price'] = f"{product['price']:,} руб.".replace(',', ' ')
-                product['short_model'] = product['model'][:30] + '...' if len(product['model']) > 30 else product['model']
-                
-                # Обрабатываем цвета и память
-                if product['all_colors']:
-                    product['colors_list'] = product['all_colors'].split(',')
-                else:
-                    product['colors_list'] = [product['current_color']] if product['current_color'] else []
-                
-                if product['all_memory']:
-                    product['memory_list'] = product['all_memory'].split(',')
-                else:
-                    product['memory_list'] = [product['current_memory']] if product['current_memory'] else []
-            
-            conn.close()
-            return products
+            return [format_product(product) for product in products]
+
+        def get_all_products(self, category=None, sort_by='price_desc', search=None, filters=None, min_price=None, max_price=None):
+            """Получение всех товаров с фильтрацией"""
+            filters = with_price_range(filters, min_price, max_price)
+            snapshot = self._snapshot()
+            if snapshot is not None:
+                return snapshot.get_all_products(category, sort_by, search, filters)
+            return self._query_products(category, sort_by, search, filters=filters)
+
+        def get_products_page(self, category=None, sort_by='price_desc', search=None, limit=50, cursor=None, filters=None,
+                              min_price=None, max_price=None):
+            """Страница товаров (keyset-пагинация): (товары, курсор следующей страницы).
+
+            Некорректный курсор вызывает ValueError.
+            """
+            filters = with_price_range(filters, min_price, max_price)
+            snapshot = self._snapshot()
+            if snapshot is not None:
+                return snapshot.get_products_page(category, sort_by, search, limit, cursor, filters)
+
+            sort_by = resolve_sort(sort_by)
+            if sort_by in OFFSET_SORTS:
+                offset = decode_cursor(cursor, sort_by) if cursor else 0
+                products = self._query_products(category, sort_by, search, limit=limit + 1, offset=offset, filters=filters)
+                next_cursor = encode_cursor(sort_by, offset=offset + limit) if len(products) > limit else None
+                return products[:limit], next_cursor
+
+            after = decode_cursor(cursor, sort_by) if cursor else None
+            products = self._query_products(category, sort_by, search, limit=limit + 1, after=after, filters=filters)
+            next_cursor = None
+            if len(products) > limit:
+                products = products[:limit]
+                next_cursor = encode_cursor(sort_by, cursor_values(sort_by, products[-1]))
+            return products, next_cursor
         
         def get_categories(self):
             """Получение списка категорий"""
-            conn = psycopg2.connect(self.db_url)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT category, COUNT(*) as count 
-                FROM iphones_catalog 
-                GROUP BY category 
-                ORDER BY count DESC
-            ''')
-            
-            categories = [{'name': row[0], 'count': row[1]} for row in cursor.fetchall()]
-            conn.close()
+            snapshot = self._snapshot()
+            if snapshot is not None:
+                return snapshot.get_categories()
+
+            with self.db_pool.cursor() as cursor:
+                cursor.execute('''
+                    SELECT category, COUNT(*) as count 
+                    FROM iphones_catalog 
+                    GROUP BY category 
+                    ORDER BY count DESC
+                ''')
+                categories = [{'name': row[0], 'count': row[1]} for row in cursor.fetchall()]
             return categories
         
         def get_featured_products(self, limit=6):
             """Получение рекомендуемых товаров"""
-            conn = psycopg2.connect(self.db_url)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT * FROM iphones_catalog 
-                WHERE is_featured = 1 
-                ORDER BY price DESC 
-                LIMIT %s
-            ''', (limit,))
-            
-            products = [dict(zip([column[0] for column in cursor.description], row)) for row in cursor.fetchall()]
-            for product in products:
-                product['formatted_price'] = f"{product['price']:,} руб.".replace(',', ' ')
-            
-            conn.close()
-            return products
+            snapshot = self._snapshot()
+            if snapshot is not None:
+                return snapshot.get_featured_products(limit)
+
+            with self.db_pool.cursor() as cursor:
+                cursor.execute('''
+                    SELECT * FROM iphones_catalog 
+                    WHERE is_featured = 1 
+                    ORDER BY price DESC 
+                    LIMIT %s
+                ''', (limit,))
+                products = [dict(zip([column[0] for column in cursor.description], row)) for row in cursor.fetchall()]
+
+            return [format_product(product) for product in products]
         
         def get_product_by_id(self, product_id):
             """Получение товара по ID"""
-            conn = psycopg2.connect(self.db_url)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT ic.*, 
-                       STRING_AGG(DISTINCT icc.color_name, ',') as all_colors,
-                       STRING_AGG(DISTINCT icm.memory_size, ',') as all_memory
-                FROM iphones_catalog ic
-                LEFT JOIN iphone_catalog_colors icc ON ic.product_id = icc.product_id
-                LEFT JOIN iphone_catalog_memory icm ON ic.product_id = icm.product_id
-                WHERE ic.product_id = %s
-                GROUP BY ic.id
-            ''', (product_id,))
-            
-            product = cursor.fetchone()
+            snapshot = self._snapshot()
+            if snapshot is not None:
+                return snapshot.get_product(product_id)
+
+            with self.db_pool.cursor() as cursor:
+                cursor.execute(PRODUCTS_QUERY + ' WHERE ic.product_id = %s', (product_id,))
+                product = cursor.fetchone()
+                columns = [column[0] for column in cursor.description]
+
             if product:
-                product = dict(zip([column[0] for column in cursor.description], product))
-                product['formatted_price'] = f"{product['price']:,} руб.".replace(',', ' ')
-                
-                if product['all_colors']:
-                    product['colors_list'] = product['all_colors'].split(',')
-                else:
-                    product['colors_list'] = []
-                
-                if product['all_memory']:
-                    product['memory_list'] = product['all_memory'].split(',')
-                else:
-                    product['memory_list'] = []
+                product = format_product(dict(zip(columns, product)))
             
-            conn.close()
             return product
 
+        def get_products_by_ids(self, product_ids, quantities=None):
+            """Получение нескольких товаров за один запрос (в порядке product_ids).
+
+            Если передан quantities ({product_id: количество}), к каждому товару
+            добавляются quantity и total_price.
+            """
+            product_ids = list(dict.fromkeys(product_ids))
+            if not product_ids:
+                return []
+
+            snapshot = self._snapshot()
+            if snapshot is not None:
+                found = {product_id: snapshot.get_product(product_id) for product_id in product_ids}
+            else:
+                with self.db_pool.cursor() as cursor:
+                    cursor.execute(PRODUCTS_QUERY + ' WHERE ic.product_id = ANY(%s)', (product_ids,))
+                    columns = [column[0] for column in cursor.description]
+                    rows = cursor.fetchall()
+                found = {}
+                for row in rows:
+                    product = format_product(dict(zip(columns, row)))
+                    found[product['product_id']] = product
+
+            products = []
+            for product_id in product_ids:
+                product = found.get(product_id)
+                if not product:
+                    continue
+                if quantities is not None:
+                    product['quantity'] = quantities.get(product_id, 0)
+                    product['total_price'] = product['price'] * product['quantity']
+                products.append(product)
+            return products
+
+        def get_facets(self, category=None, search=None, filters=None):
+            """Счетчики по фасетам (категория, цвет, память, SIM, цена) для текущего выбора"""
+            snapshot = self._snapshot()
+            if snapshot is not None:
+                return snapshot.get_facets(category, search, filters)
+
+            # Без снимка: один запрос и те же битовые маски по его результату
+            filters = dict(filters or {})
+            if category and category != 'all':
+                filters['category'] = (category,)
+            price_range = {'price_range': filters['price_range']} if 'price_range' in filters else None
+            return FacetIndex(self._query_products(search=search, filters=price_range)).counts(filters)
+
+        def get_similar_products(self, product, limit=4):
+            """Похожие товары из предвычисленного списка similar_ids"""
+            similar_ids = [product_id for product_id in (product.get('similar_ids') or []) if product_id != product['product_id']]
+            return self.get_products_by_ids(similar_ids[:limit])
+
+        def get_product_count(self, category=None, search=None, filters=None):
+            """Количество товаров (всего или в категории) без загрузки каталога"""
+            snapshot = self._snapshot()
+            if snapshot is not None:
+                return snapshot.get_product_count(category, search, filters)
+
+            if filters or (search and tokenize(search)):
+                conditions, params, _ = self._filters(category, search, filters)
+                with self.db_pool.cursor() as cursor:
+                    cursor.execute("SELECT COUNT(*) FROM iphones_catalog ic WHERE " + " AND ".join(conditions), params)
+                    return cursor.fetchone()[0]
+
+            with self.db_pool.cursor() as cursor:
+                cursor.execute(COUNTS_QUERY)
+                row = cursor.fetchone()
+            if not row:
+                return 0
+            _, product_count, category_counts = row
+            if category and category != 'all':
+                return (category_counts or {}).get(category, 0)
+            return product_count
+
+        def get_version(self):
+            """Версия каталога, из которой отдаются данные (None без снимка)"""
+            snapshot = self._snapshot()
+            return snapshot.version if snapshot is not None else None
+
     # Инициализация каталога
-    catalog = iPhoneCatalog()
+    snapshot_store = None
+    if os.environ.get('CATALOG_SNAPSHOT', '1') != '0':
+        snapshot_store = CatalogSnapshotStore.from_env(db_pool)
+    catalog = iPhoneCatalog(db_pool, snapshot_store)
+    app.extensions['catalog'] = catalog
+
+    app.config['CATALOG_PAGE_SIZE'] = int(os.environ.get('CATALOG_PAGE_SIZE', 48))
+    app.config['CATALOG_MAX_PAGE_SIZE'] = int(os.environ.get('CATALOG_MAX_PAGE_SIZE', 200))
+
+    def _page_limit(default):
+        """Размер страницы из параметра limit, ограниченный CATALOG_MAX_PAGE_SIZE"""
+        limit = request.args.get('limit', default, type=int)
+        return max(1, min(limit or default, app.config['CATALOG_MAX_PAGE_SIZE']))
+
+    # --- Rendered page cache ---
+    fragment_cache = FragmentCache(int(os.environ.get('FRAGMENT_CACHE_SIZE', 256)))
+    app.extensions['fragment_cache'] = fragment_cache
+
+    def render_cached(template_name, key, build):
+        """Рендер страницы каталога через кэш.
+
+        Закэшированный HTML зависит только от версии каталога и key;
+        значок корзины и flash-сообщения подставляются для каждого запроса.
+        build() возвращает контекст шаблона и вызывается только при промахе.
+        """
+        version = catalog.get_version()
+        if version is None:
+            return render_template(template_name, **build())
+
+        html = fragment_cache.get_or_render(
+            (template_name, version) + tuple(key),
+            lambda: render_template(template_name, cacheable_fragment=True, **build()),
+        )
+        return (html
+                .replace(CART_BADGE_MARKER, render_template('_cart_badge.html', cart_count=_cart_count()), 1)
+                .replace(FLASHES_MARKER, render_template('_flashes.html'), 1))
+
+    # Закодированные JSON-ответы API для текущей версии каталога
+    json_cache = FragmentCache(int(os.environ.get('API_CACHE_SIZE', 512)))
+    app.extensions['json_cache'] = json_cache
+
+    def json_cached(key, build):
+        """JSON-ответ из кэша; build() вызывается и кодируется только при промахе"""
+        version = catalog.get_version()
+        if version is None:
+            body = fast_json.dumps(build())
+        else:
+            body = json_cache.get_or_render((version,) + tuple(key), lambda: fast_json.dumps(build()))
+        return app.response_class(body, mimetype='application/json')
 
     @app.errorhandler(Exception)
     def handle_exception(e):
@@ -204,13 +394,14 @@ def create_app():
     @app.route('/')
     def index():
         """╨У╨╗╨░╨▓╨╜╨░╤П ╤Б╤В╤А╨░╨╜╨╕╤Ж╨░"""
-        featured_products = catalog.get_featured_products(6)
-        categories = catalog.get_categories()
-        
-        return render_template('index.html', 
-                             featured_products=featured_products,
-                             categories=categories,
-                             total_products=len(catalog.get_all_products()))
+        def build():
+            featured_products = catalog.get_featured_products(6)
+            categories = catalog.get_categories()
+            return dict(featured_products=featured_products,
+                        categories=categories,
+                        total_products=catalog.get_product_count())
+
+        return render_cached('index.html', (), build)
 
     @app.route('/catalog')
     def catalog_page():
@@ -218,17 +409,33 @@ def create_app():
         category = request.args.get('category', 'all')
         sort_by = request.args.get('sort', 'price_desc')
         search = request.args.get('search', '')
+        cursor = request.args.get('cursor')
+        limit = _page_limit(app.config['CATALOG_PAGE_SIZE'])
+        # Категория на странице выбирается одна, через параметр category
+        filters = parse_facet_filters(request.args)
+        filters.pop('category', None)
         
-        products = catalog.get_all_products(category, sort_by, search)
-        categories = catalog.get_categories()
-        
-        return render_template('catalog.html',
-                             products=products,
-                             categories=categories,
-                             current_category=category,
-                             current_sort=sort_by,
-                             search_query=search,
-                             total_products=len(products))
+        def build():
+            products, next_cursor = catalog.get_products_page(category, sort_by, search, limit, cursor, filters)
+            categories = catalog.get_categories()
+            return dict(products=products,
+                        categories=categories,
+                        facets=catalog.get_facets(category, search, filters),
+                        current_category=category,
+                        current_sort=sort_by,
+                        current_filters={facet: values for facet, values in filters.items() if facet in FACETS},
+                        min_price=(filters.get('price_range') or (None, None))[0],
+                        max_price=(filters.get('price_range') or (None, None))[1],
+                        search_query=search,
+                        next_cursor=next_cursor,
+                        # Размер страницы по умолчанию в ссылку не попадает
+                        limit=limit if limit != app.config['CATALOG_PAGE_SIZE'] else None,
+                        total_products=catalog.get_product_count(category, search, filters))
+
+        try:
+            return render_cached('catalog.html', (category, sort_by, search, cursor, limit, filters_key(filters)), build)
+        except ValueError:
+            return "Некорректный курсор", 400
 
     @app.route('/product/<product_id>')
     def product_detail(product_id):
@@ -237,81 +444,50 @@ def create_app():
         if not product:
             return "Товар не найден", 404
         
-        # Похожие товары
-        similar_products = catalog.get_all_products(category=product['category'])[:4]
-        
-        return render_template('product.html',
-                             product=product,
-                             similar_products=similar_products)
+        def build():
+            # Похожие товары
+            similar_products = catalog.get_similar_products(product, 4)
+            return dict(product=product, similar_products=similar_products)
+
+        return render_cached('product.html', (product_id,), build)
 
     @app.route('/crypto_pay_cart')
     def crypto_pay_cart():
         """Creates a single Coinbase charge for the entire cart."""
+        client = get_coinbase_client()
         if not client:
             flash('Crypto payments are currently disabled.', 'danger')
             return redirect(url_for('cart'))
 
-        cart_session = session.get('cart', {})
+        _, cart_session = _cart_items()
         if not cart_session:
             flash('Your cart is empty.', 'info')
             return redirect(url_for('cart'))
 
-        # 1. Calculate total price and gather item details
-        total_price = 0
-        item_ids = []
-        item_descriptions = []
-        for product_id, quantity in cart_session.items():
-            product = catalog.get_product_by_id(product_id)
-            if product:
-                total_price += product['price'] * quantity
-                item_ids.append(product_id)
-                item_descriptions.append(f"{product['model']} (x{quantity})")
+        # 1. Price the cart at current prices and reserve the order id
+        with db_pool.cursor() as cursor:
+            cart_products, total_price = price_cart(cursor, cart_session)
+            if total_price:
+                cursor.execute(RESERVE_ORDER_ID_QUERY)
+                order_id = cursor.fetchone()[0]
 
-        if total_price == 0:
+        if not total_price:
             flash('Cannot process a zero-value cart.', 'danger')
             return redirect(url_for('cart'))
 
-        conn = psycopg2.connect(os.environ.get('DATABASE_URL'))
-        cursor = conn.cursor()
-        # Store a comma-separated list of product IDs for simplicity
-        product_ids_str = ",".join(item_ids)
-        cursor.execute(
-            'INSERT INTO orders (product_id, price, status) VALUES (%s, %s, %s) RETURNING id',
-            (product_ids_str, total_price, 'new')
+        # 2. Create a Coinbase Commerce charge for the cart
+        charge_info = cart_charge_info(
+            cart_products, cart_session, order_id, total_price,
+            redirect_url=url_for('order_status', order_id=order_id, _external=True),
+            cancel_url=url_for('cart', _external=True),
         )
-        order_id = cursor.fetchone()[0]
-        conn.commit()
-        conn.close()
-
-        # 3. Create a Coinbase Commerce charge for the cart
-        charge_info = {
-            'name': f'Your Order #{order_id} from TonStore',
-            'description': ", ".join(item_descriptions),
-            'local_price': {
-                'amount': str(total_price),
-                'currency': 'RUB'
-            },
-            'pricing_type': 'fixed_price',
-            'metadata': {
-                'order_id': order_id,
-                'cart_items': json.dumps(cart_session)
-            },
-            'redirect_url': url_for('order_status', order_id=order_id, _external=True),
-            'cancel_url': url_for('cart', _external=True),
-        }
 
         try:
-            charge = client.charge.create(**charge_info)
-            
-            # Save the charge code to the order
-            conn = psycopg2.connect(os.environ.get('DATABASE_URL'))
-            cursor = conn.cursor()
-            cursor.execute(
-                'UPDATE orders SET charge_code = %s, status = %s WHERE id = %s',
-                (charge.code, 'pending', order_id)
-            )
-            conn.commit()
-            conn.close()
+            charge = client.create_charge(**charge_info)
+
+            # Save the order with its lines and charge code
+            with db_pool.cursor() as cursor:
+                save_order(cursor, order_id, cart_products, total_price, charge.code)
 
             return redirect(charge.hosted_url)
         except Exception as e:
@@ -322,6 +498,7 @@ def create_app():
     @app.route('/crypto_pay/<product_id>')
     def crypto_pay(product_id):
         """Creates an order and redirects to a Coinbase Commerce charge page."""
+        client = get_coinbase_client()
         if not client:
             flash('Crypto payments are currently disabled.', 'danger')
             return redirect(url_for('product_detail', product_id=product_id))
@@ -330,46 +507,24 @@ def create_app():
         if not product:
             return "Товар не найден", 404
 
-        # 1. Create a new order in the database
-        conn = psycopg2.connect(os.environ.get('DATABASE_URL'))
-        cursor = conn.cursor()
-        cursor.execute(
-            'INSERT INTO orders (product_id, price, status) VALUES (%s, %s, %s) RETURNING id',
-            (product['product_id'], product['price'], 'new')
-        )
-        order_id = cursor.fetchone()[0]
-        conn.commit()
-        conn.close()
+        # 1. Reserve the order id; the order is saved with its charge below
+        with db_pool.cursor() as cursor:
+            cursor.execute(RESERVE_ORDER_ID_QUERY)
+            order_id = cursor.fetchone()[0]
 
         # 2. Create a Coinbase Commerce charge
-        charge_info = {
-            'name': product['model'],
-            'description': f"Order #{order_id}",
-            'local_price': {
-                'amount': str(product['price']),
-                'currency': 'RUB'
-            },
-            'pricing_type': 'fixed_price',
-            'metadata': {
-                'order_id': order_id,
-                'product_id': product['product_id']
-            },
-            'redirect_url': url_for('order_status', order_id=order_id, _external=True),
-            'cancel_url': url_for('product_detail', product_id=product_id, _external=True),
-        }
+        charge_info = product_charge_info(
+            product, order_id,
+            redirect_url=url_for('order_status', order_id=order_id, _external=True),
+            cancel_url=url_for('product_detail', product_id=product_id, _external=True),
+        )
 
         try:
-            charge = client.charge.create(**charge_info)
-            
-            # Save the charge code to the order
-            conn = psycopg2.connect(os.environ.get('DATABASE_URL'))
-            cursor = conn.cursor()
-            cursor.execute(
-                'UPDATE orders SET charge_code = %s, status = %s WHERE id = %s',
-                (charge.code, 'pending', order_id)
-            )
-            conn.commit()
-            conn.close()
+            charge = client.create_charge(**charge_info)
+
+            # Save the order with its line and charge code
+            with db_pool.cursor() as cursor:
+                save_order(cursor, order_id, [product_line(product)], product['price'], charge.code)
 
             return redirect(charge.hosted_url)
         except Exception as e:
@@ -377,64 +532,135 @@ def create_app():
             return redirect(url_for('product_detail', product_id=product_id))
 
 
+    # Webhook queue workers; threads start with the first request, so importing
+    # the app (gunicorn preload, serverless cold start) never spawns them
+    webhook_workers = WebhookWorkerPool.from_env(db_pool)
+    app.extensions['webhook_workers'] = webhook_workers
+    # Without worker threads (serverless) the webhook request drains the queue
+    # itself before answering, so no batch is left half-done in a frozen function
+    app.config['WEBHOOK_INLINE_DRAIN'] = os.environ.get(
+        'WEBHOOK_INLINE_DRAIN', '1' if os.environ.get('VERCEL') else '0') == '1'
+
+    @app.before_request
+    def start_webhook_workers():
+        webhook_workers.start()
+
     @app.route('/webhooks/coinbase', methods=['POST'])
     def coinbase_webhook():
         """Handles incoming webhooks from Coinbase Commerce."""
         if not COINBASE_WEBHOOK_SECRET:
             return "Webhook secret not configured", 500
 
+        from coinbase_commerce.error import SignatureVerificationError, WebhookInvalidPayload
+        from coinbase_commerce.webhook import Webhook
+
         sig_header = request.headers.get('X-CC-Webhook-Signature')
-        payload = request.data
+        # The SDK signs and parses the body as text
+        payload = request.get_data(as_text=True)
 
         try:
             event = Webhook.construct_event(payload, sig_header, COINBASE_WEBHOOK_SECRET)
-        except (Webhook.SignatureVerificationError, Webhook.WebhookInvalidPayload) as e:
+        except (SignatureVerificationError, WebhookInvalidPayload) as e:
             return str(e), 400
 
-        # Handle the event
-        if event.type == 'charge:confirmed':
-            order_id = event.data.metadata.get('order_id')
-            if order_id:
-                conn = psycopg2.connect(os.environ.get('DATABASE_URL'))
-                cursor = conn.cursor()
-                cursor.execute(
-                    "UPDATE orders SET status = 'paid' WHERE id = %s",
-                    (order_id,)
-                )
-                conn.commit()
-                conn.close()
-                print(f"✅ Order {order_id} marked as paid.")
-
-        elif event.type == 'charge:failed':
-            order_id = event.data.metadata.get('order_id')
-            if order_id:
-                conn = psycopg2.connect(os.environ.get('DATABASE_URL'))
-                cursor = conn.cursor()
-                cursor.execute(
-                    "UPDATE orders SET status = 'failed' WHERE id = %s",
-                    (order_id,)
-                )
-                conn.commit()
-                conn.close()
-                print(f"❌ Order {order_id} marked as failed.")
-                
+        # Only a durable enqueue happens here; the workers update the order
+        with db_pool.cursor() as cursor:
+            enqueue(cursor, event)
+        webhook_workers.notify()
+
+        if app.config['WEBHOOK_INLINE_DRAIN']:
+            try:
+                webhook_workers.process_batch()
+            except Exception as e:
+                # The event is queued; the next webhook or a worker retries it
+                app.logger.warning(f"Inline webhook drain failed: {e}")
+
         return 'OK', 200
 
     @app.route('/order_status/<int:order_id>')
     def order_status(order_id):
         """Displays the status of an order after payment attempt."""
-        conn = psycopg2.connect(os.environ.get('DATABASE_URL'))
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM orders WHERE id = %s", (order_id,))
-        order = cursor.fetchone()
-        conn.close()
+        with db_pool.cursor() as cursor:
+            cursor.execute('''
+                SELECT o.*, COALESCE(
+                    json_agg(json_build_object(
+                        'product_id', oi.product_id, 'model', oi.model,
+                        'price', oi.price, 'quantity', oi.quantity
+                    ) ORDER BY oi.id) FILTER (WHERE oi.id IS NOT NULL),
+                    '[]'
+                ) AS items
+                FROM orders o
+                LEFT JOIN order_items oi ON oi.order_id = o.id
+                WHERE o.id = %s
+                GROUP BY o.id
+            ''', (order_id,))
+            order = cursor.fetchone()
+            columns = [column[0] for column in cursor.description]
 
         if not order:
             return "Order not found", 404
-            
-        product = catalog.get_product_by_id(order['product_id'])
 
-        return render_template('order_status.html', order=dict(zip([column[0] for column in cursor.description], order)), product=product)
+        order = dict(zip(columns, order))
+        # Orders created before order_items existed reference a single product
+        product = None if order['items'] else catalog.get_product_by_id(order['product_id'])
+
+        return render_template('order_status.html', order=order, product=product)
+
+    # One LISTEN connection per process fans out order status changes to all
+    # open status pages; started by the first stream, not at import
+    order_feed = OrderStatusFeed(db_pool.dsn)
+    app.extensions['order_feed'] = order_feed
+    # A held stream ties up a WSGI worker (a sync gunicorn worker, a serverless
+    # function), so by default the status is sent once and the browser
+    # reconnects after ORDER_STATUS_RETRY_SECONDS. Set a stream length only for
+    # threaded servers; asgi.py serves this route natively and holds it open.
+    app.config['ORDER_STATUS_STREAM_SECONDS'] = int(os.environ.get('ORDER_STATUS_STREAM_SECONDS', 0))
+    app.config['ORDER_STATUS_RETRY_SECONDS'] = int(os.environ.get('ORDER_STATUS_RETRY_SECONDS', 5))
+
+    def _order_status(order_id):
+        with db_pool.cursor() as cursor:
+            cursor.execute("SELECT status FROM orders WHERE id = %s", (order_id,))
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    @app.route('/order_status/<int:order_id>/events')
+    def order_status_events(order_id):
+        """Server-Sent Events stream of the order status until it is paid."""
+        stream_seconds = app.config['ORDER_STATUS_STREAM_SECONDS']
+        if stream_seconds > 0:
+            order_feed.start()
+            # Registered before the read so a change committed in between is kept
+            order_feed.watch(order_id)
+        status = _order_status(order_id)
+        if status is None:
+            if stream_seconds > 0:
+                order_feed.unwatch(order_id)
+            return "Order not found", 404
+        deadline = time.monotonic() + stream_seconds
+
+        def stream(status):
+            yield retry_field(app.config['ORDER_STATUS_RETRY_SECONDS'])
+            yield status_event(status)
+            while status != 'paid':
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    # The browser's EventSource reconnects on its own
+                    return
+                update = order_feed.wait(order_id, status, timeout=min(15, remaining))
+                if update is None:
+                    yield ": keepalive\n\n"
+                    # Covers changes made while the listener was reconnecting
+                    update = _order_status(order_id)
+                elif update == RESYNC:
+                    update = _order_status(order_id)
+                if status_rank(update) > status_rank(status):
+                    status = update
+                    yield status_event(status)
+
+        response = app.response_class(stream(status), mimetype='text/event-stream', headers={'X-Accel-Buffering': 'no'})
+        if stream_seconds > 0:
+            response.call_on_close(lambda: order_feed.unwatch(order_id))
+        return response
 
     @app.route('/api/products')
     def api_products():
@@ -442,44 +668,144 @@ def create_app():
         category = request.args.get('category', 'all')
         sort_by = request.args.get('sort', 'price_desc')
         search = request.args.get('search', '')
-        
-        products = catalog.get_all_products(category, sort_by, search)
-        return jsonify(products)
+
+        # Без limit/cursor API, как и раньше, отдает весь список
+        paginated = 'limit' in request.args or 'cursor' in request.args
+        limit = _page_limit(app.config['CATALOG_PAGE_SIZE']) if paginated else None
+        cursor = request.args.get('cursor')
+        filters = parse_facet_filters(request.args)
+
+        # Только нужные поля (fields=model,price или fields=grid) и колоночный формат (format=columns)
+        try:
+            fields = parse_fields(request.args.get('fields'))
+            fmt = parse_format(request.args.get('format'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        def build():
+            if not paginated:
+                return shape_products(catalog.get_all_products(category, sort_by, search, filters), fields, fmt)
+            products, next_cursor = catalog.get_products_page(category, sort_by, search, limit, cursor, filters)
+            return {'products': shape_products(products, fields, fmt), 'next_cursor': next_cursor}
+
+        key = ('api_products', category, resolve_sort(sort_by), normalize_query(search), filters_key(filters), limit, cursor, fields, fmt)
+        try:
+            return json_cached(key, build)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+    @app.route('/api/facets')
+    def api_facets():
+        """API для счетчиков фасетов (категория, цвет, память, SIM, цена)"""
+        category = request.args.get('category', 'all')
+        search = request.args.get('search', '')
+        filters = parse_facet_filters(request.args)
+
+        def build():
+            return {
+                'facets': catalog.get_facets(category, search, filters),
+                'total': catalog.get_product_count(category, search, filters),
+            }
+
+        return json_cached(('api_facets', category, normalize_query(search), filters_key(filters)), build)
 
     @app.route('/api/categories')
     def api_categories():
         """API для получения категорий"""
-        categories = catalog.get_categories()
-        return jsonify(categories)
+        return json_cached(('api_categories',), catalog.get_categories)
+
+    @app.route('/health/db')
+    def db_health():
+        """Statistics of the shared database connection pool."""
+        return jsonify(db_pool.stats())
+
+    @app.route('/health/webhooks')
+    def webhook_health():
+        """Webhook queue depth and worker counters."""
+        with db_pool.cursor() as cursor:
+            cursor.execute('''
+                SELECT COUNT(*) FILTER (WHERE NOT dead), COUNT(*) FILTER (WHERE dead),
+                       EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - MIN(created_at) FILTER (WHERE NOT dead))
+                FROM webhook_queue
+            ''')
+            pending, dead, oldest = cursor.fetchone()
+        return jsonify({
+            'pending': pending,
+            'dead': dead,
+            'oldest_pending_seconds': float(oldest) if oldest is not None else None,
+            'workers': webhook_workers.stats(),
+        })
+
+    @app.route('/health/cache')
+    def cache_health():
+        """Statistics of the rendered page cache."""
+        return jsonify({'pages': fragment_cache.stats(), 'api': json_cache.stats()})
+
+    # --- Server-side cart ---
+    # В cookie сессии лежит ключ корзины (cart_id или tg_user_id) и количество
+    # товаров для значка; сами товары, количество и сумма - в cart_store
+    cart_store = cart_store_from_env(db_pool)
+    app.extensions['cart_store'] = cart_store
+    app.config['TELEGRAM_BOT_TOKEN'] = os.environ.get('TELEGRAM_BOT_TOKEN')
+
+    def _cart_key(create=False):
+        """Ключ корзины текущей сессии; create=True заводит корзину, если ее еще нет"""
+        legacy_cart = session.pop('cart') if 'cart' in session else None
+        key = cart_key_for(session)
+        if key is None and (create or legacy_cart):
+            session['cart_id'] = uuid.uuid4().hex
+            session.permanent = True
+            key = cart_key_for(session)
+        # Корзина из cookie, сохраненная до перехода на cart_store
+        for product_id, quantity in (legacy_cart or {}).items():
+            _remember_cart_count(cart_store.add(key, product_id, quantity))
+        return key
+
+    def _remember_cart_count(count):
+        """Запоминает количество товаров в cookie сессии после изменения корзины,
+        чтобы значок и ETag страниц каталога не обращались к cart_store"""
+        g.cart_count = count
+        if session.get('cart_count') != count:
+            session['cart_count'] = count
+        return count
+
+    def _cart_items():
+        """Ключ и товары корзины текущей сессии"""
+        key = _cart_key()
+        return key, (cart_store.get(key) if key else {})
 
     @app.route('/cart')
     def cart():
         """Страница корзины"""
-        if 'cart' not in session:
-            session['cart'] = {}
-        
-        cart_products = []
-        total_price = 0
-        
-        for product_id, quantity in session['cart'].items():
-            product = catalog.get_product_by_id(product_id)
-            if product:
-                product['quantity'] = quantity
-                product['total_price'] = product['price'] * quantity
-                cart_products.append(product)
-                total_price += product['total_price']
-                
-        return render_template('cart.html', cart_products=cart_products, total_price=total_price, catalog=catalog, total_products=len(catalog.get_all_products()))
+        key, items = _cart_items()
+        if key:
+            _remember_cart_count(sum(items.values()))
+        cart_products = catalog.get_products_by_ids(items.keys(), items)
+        total_price = sum(product['total_price'] for product in cart_products)
+
+        return render_template('cart.html', cart_products=cart_products, total_price=total_price, catalog=catalog, total_products=catalog.get_product_count())
+
+    @app.route('/api/cart')
+    def api_cart():
+        """Количество товаров и сумма корзины (для значка и кнопки оплаты в Telegram)"""
+        key = _cart_key()
+        if key is None:
+            return jsonify({'count': 0, 'total_price': 0})
+        # Корзину Telegram могли изменить с другого устройства
+        count = _remember_cart_count(cart_store.count(key))
+        version = catalog.get_version()
+        total_price = cart_store.get_total(key, version) if version is not None else None
+        if total_price is None:
+            items = cart_store.get(key)
+            total_price = sum(product['total_price'] for product in catalog.get_products_by_ids(items.keys(), items))
+            if version is not None:
+                cart_store.set_total(key, version, total_price)
+        return jsonify({'count': count, 'total_price': total_price})
 
     @app.route('/add_to_cart/<product_id>')
     def add_to_cart(product_id):
         """Добавление товара в корзину"""
-        if 'cart' not in session:
-            session['cart'] = {}
-        
-        cart = session['cart']
-        cart[product_id] = cart.get(product_id, 0) + 1
-        session['cart'] = cart
+        _remember_cart_count(cart_store.add(_cart_key(create=True), product_id))
         
         flash('Товар добавлен в корзину!', 'success')
         return redirect(request.referrer or url_for('index'))
@@ -487,32 +813,112 @@ def create_app():
     @app.route('/remove_from_cart/<product_id>')
     def remove_from_cart(product_id):
         """Удаление товара из корзины"""
-        if 'cart' in session and product_id in session['cart']:
-            session['cart'].pop(product_id)
+        key = _cart_key()
+        if key and cart_store.remove(key, product_id):
+            _remember_cart_count(cart_store.count(key))
             flash('Товар удален из корзины!', 'info')
         return redirect(url_for('cart'))
 
     @app.route('/clear_cart')
     def clear_cart():
         """Очистка корзины"""
-        session.pop('cart', None)
+        key = _cart_key()
+        if key:
+            cart_store.clear(key)
+            _remember_cart_count(0)
         flash('Корзина очищена!', 'info')
         return redirect(url_for('cart'))
 
+    @app.route('/telegram/login', methods=['POST'])
+    def telegram_login():
+        """Привязка сессии к пользователю Telegram по initData из Mini App"""
+        user_id = verify_init_data(request.form.get('init_data'), app.config['TELEGRAM_BOT_TOKEN'])
+        if user_id is None:
+            return jsonify({'error': 'Invalid Telegram init data'}), 403
+
+        # Корзина, собранная до входа, переходит в корзину пользователя
+        anonymous_key = _cart_key()
+        session['tg_user_id'] = user_id
+        session.pop('cart_id', None)
+        session.permanent = True
+        if anonymous_key:
+            cart_store.merge(anonymous_key, cart_key_for(session))
+        return jsonify({'count': _remember_cart_count(cart_store.count(cart_key_for(session)))})
+
+    def _cart_count():
+        """Количество товаров в корзине текущей сессии: из cookie, в cart_store -
+        только для сессий, сохраненных до появления cart_count"""
+        if 'cart_count' not in g:
+            key = _cart_key()
+            if key is None:
+                g.cart_count = 0
+            elif 'cart_count' in session:
+                g.cart_count = session['cart_count']
+            else:
+                _remember_cart_count(cart_store.count(key))
+        return g.cart_count
+
     @app.context_processor
     def inject_cart_count():
         """Доступное количество товаров в корзине во всех шаблонах"""
-        cart_count = 0
-        if 'cart' in session:
-            cart_count = sum(session['cart'].values())
-        return dict(cart_count=cart_count)
+        return dict(cart_count=_cart_count())
+
+    # --- HTTP caching ---
+    app.config['CATALOG_CDN_MAX_AGE'] = int(os.environ.get('CATALOG_CDN_MAX_AGE', 0))
+    static_versions = StaticVersions(app.static_folder)
+
+    @app.url_defaults
+    def add_static_version(endpoint, values):
+        """Version query parameter for static URLs so they can be cached forever."""
+        if endpoint == 'static' and 'filename' in values and 'v' not in values:
+            version = static_versions.get(values['filename'])
+            if version:
+                values['v'] = version
+
+    def _catalog_validators():
+        """ETag and Last-Modified for the current catalog request, or (None, None)."""
+        policy = CACHE_POLICIES.get(request.endpoint)
+        if policy not in (PAGE, API) or request.method not in ('GET', 'HEAD'):
+            return None, None
+        snapshot = catalog._snapshot()
+        if snapshot is None:
+            return None, None
+        if policy == PAGE:
+            # Pages show the cart badge and flashed messages, so they are per session
+            if session.get('_flashes'):
+                return None, None
+            return make_etag(snapshot.version, request.full_path, _cart_count()), None
+        return make_etag(snapshot.version, request.full_path), to_utc(snapshot.updated_at)
+
+    @app.before_request
+    def conditional_catalog_request():
+        """Answer 304 before doing any work if the client has the current catalog version."""
+        g.catalog_validators = _catalog_validators()
+        etag, last_modified = g.catalog_validators
+        if etag and is_not_modified(request, etag, last_modified):
+            return app.response_class(status=304)
 
     @app.after_request
     def add_header(response):
-        """Add headers to prevent caching."""
-        response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-        response.headers['Pragma'] = 'no-cache'
-        response.headers['Expires'] = '0'
+        """Add caching headers according to the route's cache policy."""
+        policy = CACHE_POLICIES.get(request.endpoint)
+        etag, last_modified = g.get('catalog_validators', (None, None))
+
+        if policy == STATIC and response.status_code in (200, 304):
+            # Versioned URLs never change; unversioned ones are revalidated
+            response.headers['Cache-Control'] = STATIC_CACHE_CONTROL if request.args.get('v') else 'public, no-cache'
+        elif etag and response.status_code in (200, 304):
+            response.set_etag(etag, weak=True)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            if policy == PAGE:
+                response.headers['Cache-Control'] = 'private, no-cache'
+            else:
+                response.headers['Cache-Control'] = api_cache_control(app.config['CATALOG_CDN_MAX_AGE'])
+        else:
+            response.headers['Cache-Control'] = NO_STORE
+            response.headers['Pragma'] = 'no-cache'
+            response.headers['Expires'] = '0'
         return response
 
     return app
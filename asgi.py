@@ -0,0 +1,322 @@
+# asgi.py
+"""ASGI entry point: `uvicorn asgi:app` or `gunicorn -k uvicorn.workers.UvicornWorker asgi:app`.
+
+The payment routes, which spend most of their time waiting on Coinbase and
+the database, are served natively with asyncpg and an async HTTP client, so
+a slow charge creation no longer holds a worker thread; so is the order
+status stream, which waits on LISTEN/NOTIFY for minutes. Everything else is
+the regular Flask app, run on a pool of ASGI_WSGI_THREADS threads (default:
+its pool size) so database-bound pages are served concurrently.
+
+DB_POOL_MAX is the connection budget of the whole process: the asyncpg pool
+takes ASYNC_DB_POOL_MAX of it and the Flask app's psycopg2 pool the rest.
+"""
+import asyncio
+import logging
+import os
+import re
+
+from a2wsgi import WSGIMiddleware
+from werkzeug.http import dump_cookie, parse_cookie
+
+from app import create_app
+from async_db import AsyncConnectionPool
+from cart_store import cart_key_for
+from coinbase_async import AsyncCommerceClient
+from db_pool import ConnectionPool
+from http_cache import NO_STORE
+from order_status_async import AsyncOrderStatusFeed
+from order_status_feed import RESYNC, retry_field, status_event
+from payments import (
+    PRICE_CART_QUERY, RESERVE_ORDER_ID_QUERY, SAVE_ORDER_QUERY,
+    asyncpg_query, cart_charge_info, order_params, product_charge_info, product_line,
+)
+from webhook_events import status_rank
+
+logger = logging.getLogger(__name__)
+
+# asyncpg placeholders, generated from the payments.py statements
+ASYNC_RESERVE_ORDER_ID_QUERY = asyncpg_query(RESERVE_ORDER_ID_QUERY)
+ASYNC_PRICE_CART_QUERY = asyncpg_query(PRICE_CART_QUERY)
+ASYNC_SAVE_ORDER_QUERY = asyncpg_query(SAVE_ORDER_QUERY)
+
+db = AsyncConnectionPool.from_env()
+flask_app = create_app(ConnectionPool.from_env(reserved=db.max_size))
+# Not asgiref's WsgiToAsgi: it runs every WSGI request on one shared thread
+wsgi_app = WSGIMiddleware(flask_app, workers=int(os.environ.get('ASGI_WSGI_THREADS', flask_app.config['DB_POOL_MAX'])))
+catalog = flask_app.extensions['catalog']
+cart_store = flask_app.extensions['cart_store']
+
+coinbase = AsyncCommerceClient.from_env()
+order_feed = AsyncOrderStatusFeed(db.dsn)
+# Unlike the WSGI default, a stream here costs no thread and can stay open
+ORDER_STATUS_STREAM_SECONDS = int(os.environ.get('ORDER_STATUS_STREAM_SECONDS', 300))
+# Set on startup; routes not listed here fall through to the Flask views
+native_routes = []
+
+
+class FlaskSession:
+    """Reads and writes Flask's signed session cookie so flashes and the
+    cart key are shared between the native routes and the Flask app."""
+
+    def __init__(self, app):
+        self.app = app
+        self.interface = app.session_interface
+        self.serializer = self.interface.get_signing_serializer(app)
+        self.cookie_name = self.interface.get_cookie_name(app)
+        self.max_age = int(app.permanent_session_lifetime.total_seconds())
+
+    def load(self, headers):
+        value = parse_cookie(headers.get('cookie', '')).get(self.cookie_name)
+        if not value:
+            return {}
+        try:
+            return dict(self.serializer.loads(value, max_age=self.max_age))
+        except Exception:
+            return {}
+
+    def cookie(self, data):
+        app = self.app
+        return dump_cookie(
+            self.cookie_name,
+            self.serializer.dumps(data),
+            max_age=self.max_age if data.get('_permanent') else None,
+            path=self.interface.get_cookie_path(app),
+            domain=self.interface.get_cookie_domain(app),
+            secure=self.interface.get_cookie_secure(app),
+            httponly=self.interface.get_cookie_httponly(app),
+            samesite=self.interface.get_cookie_samesite(app),
+        )
+
+
+sessions = FlaskSession(flask_app)
+
+
+def _headers(scope):
+    return {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+
+
+def _url_for(scope, headers, endpoint, **values):
+    """External URL of a Flask endpoint for this request (like url_for(..., _external=True))."""
+    host = headers.get('host') or flask_app.config.get('SERVER_NAME') or 'localhost'
+    adapter = flask_app.url_map.bind(host, script_name=scope.get('root_path') or '/', url_scheme=scope.get('scheme', 'http'))
+    return adapter.build(endpoint, values, force_external=True)
+
+
+async def _redirect(send, location, session=None):
+    headers = [
+        (b'location', location.encode('latin-1')),
+        (b'content-length', b'0'),
+        (b'cache-control', NO_STORE.encode('latin-1')),
+    ]
+    if session is not None:
+        headers.append((b'set-cookie', sessions.cookie(session).encode('latin-1')))
+    await send({'type': 'http.response.start', 'status': 302, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def _not_found(send, message):
+    body = message.encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': 404,
+        'headers': [(b'content-type', b'text/html; charset=utf-8'), (b'content-length', str(len(body)).encode())],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def _flash(session, message, category):
+    session['_flashes'] = list(session.get('_flashes', [])) + [(category, message)]
+    return session
+
+
+async def _price_cart(cart):
+    """Cart lines and total at current prices (payments.price_cart over asyncpg)."""
+    product_ids = list(cart)
+    async with db.acquire() as connection:
+        rows = await connection.fetch(ASYNC_PRICE_CART_QUERY, product_ids, [int(cart[product_id]) for product_id in product_ids])
+    lines = [
+        {key: row[key] for key in ('product_id', 'model', 'price', 'quantity', 'total_price')}
+        for row in rows
+    ]
+    return lines, (rows[0]['cart_total'] if rows else 0)
+
+
+async def _create_charge(lines, total_price, build_charge_info):
+    """Creates the charge and saves the order with its lines and code; returns the charge."""
+    async with db.acquire() as connection:
+        order_id = await connection.fetchval(ASYNC_RESERVE_ORDER_ID_QUERY)
+
+    charge = await coinbase.create_charge(**build_charge_info(order_id))
+
+    async with db.acquire() as connection:
+        await connection.execute(ASYNC_SAVE_ORDER_QUERY, *order_params(order_id, lines, total_price, charge.code))
+    return charge
+
+
+async def crypto_pay(scope, receive, send, product_id):
+    headers = _headers(scope)
+    product = await asyncio.to_thread(catalog.get_product_by_id, product_id)
+    if not product:
+        await _not_found(send, "Товар не найден")
+        return
+
+    cancel_url = _url_for(scope, headers, 'product_detail', product_id=product_id)
+    try:
+        charge = await _create_charge(
+            [product_line(product)], product['price'],
+            lambda order_id: product_charge_info(
+                product, order_id,
+                redirect_url=_url_for(scope, headers, 'order_status', order_id=order_id),
+                cancel_url=cancel_url,
+            ),
+        )
+    except Exception as e:
+        logger.warning("Payment for product %s failed: %s", product_id, e)
+        session = _flash(sessions.load(headers), f'Error creating payment: {e}', 'danger')
+        await _redirect(send, cancel_url, session)
+        return
+    await _redirect(send, charge.hosted_url)
+
+
+async def crypto_pay_cart(scope, receive, send):
+    headers = _headers(scope)
+    session = sessions.load(headers)
+    cart_url = _url_for(scope, headers, 'cart')
+
+    key = cart_key_for(session)
+    cart = await asyncio.to_thread(cart_store.get, key) if key else {}
+    if not cart:
+        await _redirect(send, cart_url, _flash(session, 'Your cart is empty.', 'info'))
+        return
+
+    cart_products, total_price = await _price_cart(cart)
+    if not total_price:
+        await _redirect(send, cart_url, _flash(session, 'Cannot process a zero-value cart.', 'danger'))
+        return
+
+    try:
+        charge = await _create_charge(
+            cart_products, total_price,
+            lambda order_id: cart_charge_info(
+                cart_products, cart, order_id, total_price,
+                redirect_url=_url_for(scope, headers, 'order_status', order_id=order_id),
+                cancel_url=cart_url,
+            ),
+        )
+    except Exception as e:
+        logger.warning("Payment for cart failed: %s", e)
+        await _redirect(send, cart_url, _flash(session, f'Error creating payment: {e}', 'danger'))
+        return
+    await _redirect(send, charge.hosted_url)
+
+
+async def _order_status(order_id):
+    async with db.acquire() as connection:
+        return await connection.fetchval('SELECT status FROM orders WHERE id = $1', order_id)
+
+
+async def _disconnected(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def order_status_events(scope, receive, send, order_id):
+    """Server-Sent Events stream of the order status until it is paid."""
+    order_id = int(order_id)
+    order_feed.start()
+    # Registered before the read so a change committed in between is kept
+    queue = order_feed.watch(order_id)
+    disconnected = asyncio.ensure_future(_disconnected(receive))
+    try:
+        status = await _order_status(order_id)
+        if status is None:
+            await _not_found(send, "Order not found")
+            return
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream; charset=utf-8'),
+                (b'cache-control', NO_STORE.encode('latin-1')),
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+
+        async def emit(chunk):
+            await send({'type': 'http.response.body', 'body': chunk.encode('utf-8'), 'more_body': True})
+
+        await emit(retry_field(flask_app.config['ORDER_STATUS_RETRY_SECONDS']))
+        await emit(status_event(status))
+        deadline = asyncio.get_running_loop().time() + ORDER_STATUS_STREAM_SECONDS
+        while status != 'paid':
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                # The browser's EventSource reconnects on its own
+                break
+            next_update = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait({next_update, disconnected}, timeout=min(15, remaining), return_when=asyncio.FIRST_COMPLETED)
+            if disconnected in done:
+                next_update.cancel()
+                return
+            if next_update in done:
+                update = next_update.result()
+            else:
+                next_update.cancel()
+                await emit(": keepalive\n\n")
+                # Covers changes made while the listener was reconnecting
+                update = RESYNC
+            if update == RESYNC:
+                update = await _order_status(order_id)
+            if status_rank(update) > status_rank(status):
+                status = update
+                await emit(status_event(status))
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        disconnected.cancel()
+        order_feed.unwatch(order_id, queue)
+
+
+PAYMENT_ROUTES = [
+    (re.compile(r'^/crypto_pay/(?P<product_id>[^/]+)$'), crypto_pay),
+    (re.compile(r'^/crypto_pay_cart$'), crypto_pay_cart),
+]
+STREAM_ROUTES = [
+    (re.compile(r'^/order_status/(?P<order_id>[0-9]+)/events$'), order_status_events),
+]
+
+
+async def lifespan(receive, send):
+    global native_routes
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                await db.open()
+                native_routes = STREAM_ROUTES + (PAYMENT_ROUTES if coinbase is not None else [])
+            except Exception as e:
+                logger.warning("Async database pool unavailable, all routes stay on the Flask views: %s", e)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            native_routes = []
+            await order_feed.close()
+            await db.close()
+            if coinbase is not None:
+                await coinbase.aclose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+
+    if scope['type'] == 'http' and scope['method'] in ('GET', 'HEAD'):
+        for pattern, handler in native_routes:
+            match = pattern.match(scope['path'])
+            if match:
+                await handler(scope, receive, send, **match.groupdict())
+                return
+
+    await wsgi_app(scope, receive, send)
@@ -0,0 +1,69 @@
+# async_db.py
+import os
+import logging
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncConnectionPool:
+    """asyncpg pool for the ASGI serving mode (see asgi.py).
+
+    Sized by ASYNC_DB_POOL_MAX (default 3), which asgi.py takes out of the
+    DB_POOL_MAX budget of the Flask pool; DB_POOL_MIN and DB_POOL_TIMEOUT are
+    shared with db_pool.ConnectionPool. Opened on ASGI startup and closed on
+    shutdown.
+    """
+
+    def __init__(self, dsn, min_size=1, max_size=10, timeout=5.0):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self._pool = None
+
+    @classmethod
+    def from_env(cls, dsn=None):
+        max_size = int(os.environ.get('ASYNC_DB_POOL_MAX', 3))
+        return cls(
+            dsn or os.environ.get('DATABASE_URL'),
+            min_size=min(int(os.environ.get('DB_POOL_MIN', 1)), max_size),
+            max_size=max_size,
+            timeout=float(os.environ.get('DB_POOL_TIMEOUT', 5)),
+        )
+
+    async def open(self):
+        if self._pool is None:
+            if not self.dsn:
+                raise Exception("DATABASE_URL environment variable not set")
+            self._pool = await asyncpg.create_pool(
+                self.dsn,
+                min_size=self.min_size,
+                max_size=self.max_size,
+                # Supabase's pooler does not support prepared statement caching
+                statement_cache_size=0,
+            )
+            logger.info("Async database pool opened (%d-%d connections)", self.min_size, self.max_size)
+
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    def acquire(self):
+        """Async context manager yielding a connection, waiting at most `timeout` seconds."""
+        if self._pool is None:
+            raise Exception("Async database pool is not open")
+        return self._pool.acquire(timeout=self.timeout)
+
+    def stats(self):
+        if self._pool is None:
+            return {'open': False}
+        return {
+            'open': True,
+            'min_size': self.min_size,
+            'max_size': self.max_size,
+            'size': self._pool.get_size(),
+            'idle': self._pool.get_idle_size(),
+        }
@@ -0,0 +1,205 @@
+# cart_store.py
+import os
+import threading
+from collections import OrderedDict
+
+from psycopg2.extras import Json
+
+
+def cart_key_for(session):
+    """Ключ корзины: пользователь Telegram или токен сессии (None - корзины еще нет)"""
+    if session.get('tg_user_id'):
+        return f"tg:{session['tg_user_id']}"
+    if session.get('cart_id'):
+        return f"s:{session['cart_id']}"
+    return None
+
+
+class MemoryCartStore:
+    """Корзины в памяти процесса: для разработки и одного воркера.
+
+    Тот же интерфейс, что у PostgresCartStore; количество товаров хранится
+    вместе с корзиной, сумма - вместе с версией каталога, по которой посчитана.
+    """
+
+    def __init__(self, max_carts=10000):
+        self.max_carts = max_carts
+        self._carts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cart(self, key):
+        cart = self._carts.get(key)
+        if cart is None:
+            cart = self._carts[key] = {'items': {}, 'count': 0, 'total': None}
+            while len(self._carts) > self.max_carts:
+                self._carts.popitem(last=False)
+        self._carts.move_to_end(key)
+        return cart
+
+    def get(self, key):
+        with self._lock:
+            cart = self._carts.get(key)
+            return dict(cart['items']) if cart else {}
+
+    def count(self, key):
+        with self._lock:
+            cart = self._carts.get(key)
+            return cart['count'] if cart else 0
+
+    def add(self, key, product_id, quantity=1):
+        with self._lock:
+            cart = self._cart(key)
+            cart['items'][product_id] = cart['items'].get(product_id, 0) + quantity
+            cart['count'] += quantity
+            cart['total'] = None
+            return cart['count']
+
+    def remove(self, key, product_id):
+        """Удаляет товар; True, если он был в корзине"""
+        with self._lock:
+            cart = self._carts.get(key)
+            if not cart or product_id not in cart['items']:
+                return False
+            cart['count'] -= cart['items'].pop(product_id)
+            cart['total'] = None
+            return True
+
+    def clear(self, key):
+        with self._lock:
+            self._carts.pop(key, None)
+
+    def merge(self, source_key, target_key):
+        """Переносит товары корзины source_key в target_key"""
+        if source_key == target_key:
+            return
+        with self._lock:
+            source = self._carts.pop(source_key, None)
+            if not source or not source['items']:
+                return
+            target = self._cart(target_key)
+            for product_id, quantity in source['items'].items():
+                target['items'][product_id] = target['items'].get(product_id, 0) + quantity
+            target['count'] += source['count']
+            target['total'] = None
+
+    def get_total(self, key, version):
+        with self._lock:
+            cart = self._carts.get(key)
+            if cart and cart['total'] and cart['total'][0] == version:
+                return cart['total'][1]
+            return None
+
+    def set_total(self, key, version, total):
+        with self._lock:
+            cart = self._carts.get(key)
+            if cart:
+                cart['total'] = (version, total)
+
+
+class PostgresCartStore:
+    """Корзины в таблице carts: общие для всех воркеров и устройств пользователя.
+
+    Каждая операция - один запрос по первичному ключу; item_count меняется
+    тем же запросом, что и товары, а сумма сбрасывается при любом изменении.
+    """
+
+    def __init__(self, db_pool):
+        self.db_pool = db_pool
+
+    def get(self, key):
+        with self.db_pool.cursor() as cursor:
+            cursor.execute('SELECT items FROM carts WHERE cart_key = %s', (key,))
+            row = cursor.fetchone()
+        return dict(row[0]) if row else {}
+
+    def count(self, key):
+        with self.db_pool.cursor() as cursor:
+            cursor.execute('SELECT item_count FROM carts WHERE cart_key = %s', (key,))
+            row = cursor.fetchone()
+        return row[0] if row else 0
+
+    def add(self, key, product_id, quantity=1):
+        with self.db_pool.cursor() as cursor:
+            cursor.execute('''
+                INSERT INTO carts (cart_key, items, item_count) VALUES (%s, %s, %s)
+                ON CONFLICT (cart_key) DO UPDATE SET
+                    items = carts.items || jsonb_build_object(
+                        %s::text, COALESCE((carts.items ->> %s)::int, 0) + %s),
+                    item_count = carts.item_count + %s,
+                    total_price = NULL,
+                    priced_version = NULL,
+                    updated_at = CURRENT_TIMESTAMP
+                RETURNING item_count
+            ''', (key, Json({product_id: quantity}), quantity, product_id, product_id, quantity, quantity))
+            return cursor.fetchone()[0]
+
+    def remove(self, key, product_id):
+        with self.db_pool.cursor() as cursor:
+            cursor.execute('''
+                UPDATE carts SET
+                    items = items - %s,
+                    item_count = item_count - (items ->> %s)::int,
+                    total_price = NULL,
+                    priced_version = NULL,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE cart_key = %s AND items ? %s
+            ''', (product_id, product_id, key, product_id))
+            return cursor.rowcount > 0
+
+    def clear(self, key):
+        with self.db_pool.cursor() as cursor:
+            cursor.execute('DELETE FROM carts WHERE cart_key = %s', (key,))
+
+    def merge(self, source_key, target_key):
+        if source_key == target_key:
+            return
+        with self.db_pool.cursor() as cursor:
+            cursor.execute('''
+                WITH source AS (
+                    DELETE FROM carts WHERE cart_key = %s RETURNING items
+                ), merged AS (
+                    SELECT item.key, SUM(item.value::int) AS quantity
+                    FROM (
+                        SELECT items FROM source
+                        UNION ALL
+                        SELECT items FROM carts WHERE cart_key = %s
+                    ) c, jsonb_each_text(c.items) AS item
+                    GROUP BY item.key
+                )
+                INSERT INTO carts (cart_key, items, item_count)
+                SELECT %s, jsonb_object_agg(key, quantity), SUM(quantity)
+                FROM merged
+                HAVING COUNT(*) > 0
+                ON CONFLICT (cart_key) DO UPDATE SET
+                    items = EXCLUDED.items,
+                    item_count = EXCLUDED.item_count,
+                    total_price = NULL,
+                    priced_version = NULL,
+                    updated_at = CURRENT_TIMESTAMP
+            ''', (source_key, target_key, target_key))
+
+    def get_total(self, key, version):
+        with self.db_pool.cursor() as cursor:
+            cursor.execute(
+                'SELECT total_price FROM carts WHERE cart_key = %s AND priced_version = %s',
+                (key, version),
+            )
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    def set_total(self, key, version, total):
+        with self.db_pool.cursor() as cursor:
+            cursor.execute(
+                'UPDATE carts SET total_price = %s, priced_version = %s WHERE cart_key = %s',
+                (total, version, key),
+            )
+
+
+def cart_store_from_env(db_pool):
+    """CART_STORE=postgres (по умолчанию) или memory"""
+    backend = os.environ.get('CART_STORE', 'postgres')
+    if backend == 'memory':
+        return MemoryCartStore(int(os.environ.get('CART_STORE_MAX_CARTS', 10000)))
+    if backend == 'postgres':
+        return PostgresCartStore(db_pool)
+    raise ValueError(f"Unknown CART_STORE backend: {backend}")
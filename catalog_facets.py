@@ -0,0 +1,198 @@
+# catalog_facets.py
+import re
+
+FACETS = ('category', 'color', 'memory', 'sim', 'price')
+
+# Ценовые диапазоны для фасета price: (значение, от, до не включительно)
+PRICE_BUCKETS = (
+    ('0-50000', 0, 50000),
+    ('50000-80000', 50000, 80000),
+    ('80000-100000', 80000, 100000),
+    ('100000-130000', 100000, 130000),
+    ('130000-', 130000, None),
+)
+
+_MEMORY_RE = re.compile(r'(\d+)\s*([gtгт])', re.IGNORECASE)
+
+_UNSET = {'Не указан', 'Не указана', 'Не указано'}
+
+
+def _popcount(mask):
+    # int.bit_count появился только в Python 3.10
+    return bin(mask).count('1')
+
+
+def price_bucket(price):
+    price = price or 0
+    for value, low, high in PRICE_BUCKETS:
+        if price >= low and (high is None or price < high):
+            return value
+    return PRICE_BUCKETS[0][0]
+
+
+def memory_sort_key(value):
+    """Порядок объемов памяти: 64Gb < 256Gb < 1Tb"""
+    match = _MEMORY_RE.search(value or '')
+    if not match:
+        return (1, value or '')
+    size = int(match.group(1))
+    if match.group(2).lower() in ('t', 'т'):
+        size *= 1024
+    return (0, size)
+
+
+def product_facet_values(product):
+    """Значения фасетов товара"""
+    sims = list(product.get('sim_options') or [])
+    if not sims and product.get('current_sim') not in _UNSET and product.get('current_sim'):
+        sims = [product['current_sim']]
+    return {
+        'category': [product.get('category')] if product.get('category') else [],
+        'color': [color for color in product.get('colors_list') or [] if color not in _UNSET],
+        'memory': [memory for memory in product.get('memory_list') or [] if memory not in _UNSET],
+        'sim': sims,
+        'price': [price_bucket(product.get('price'))],
+    }
+
+
+def with_price_range(filters, min_price=None, max_price=None):
+    """Фильтры с диапазоном цен (границы включительно) под ключом price_range"""
+    filters = dict(filters or {})
+    if min_price is not None or max_price is not None:
+        filters['price_range'] = (min_price, max_price)
+    return filters
+
+
+def parse_facet_filters(args):
+    """Выбранные значения фасетов и диапазон цен из параметров запроса"""
+    filters = {}
+    for facet in FACETS:
+        values = [value for value in args.getlist(facet) if value and value != 'all']
+        if values:
+            filters[facet] = tuple(sorted(set(values)))
+    return with_price_range(filters, args.get('min_price', type=int), args.get('max_price', type=int))
+
+
+def filters_key(filters):
+    """Хешируемый ключ фильтров для кэшей"""
+    return tuple(sorted((filters or {}).items()))
+
+
+class Membership:
+    """Множество позиций битовой маски с проверкой за O(1)"""
+
+    def __init__(self, mask, positions):
+        # Развернутая двоичная строка: символ i - бит i
+        self._bits = bin(mask)[:1:-1]
+        self._positions = positions
+
+    def __contains__(self, product_id):
+        position = self._positions.get(product_id)
+        return position is not None and position < len(self._bits) and self._bits[position] == '1'
+
+
+class FacetIndex:
+    """Битовые маски (int) товаров для каждого значения каждого фасета.
+
+    Внутри фасета выбранные значения объединяются (OR), между фасетами -
+    пересекаются (AND). Счетчики фасета считаются без учета его собственного
+    выбора, чтобы было видно, сколько товаров даст соседнее значение.
+    """
+
+    def __init__(self, products):
+        self.positions = {}
+        self.bitmaps = {facet: {} for facet in FACETS}
+        for position, product in enumerate(products):
+            self.positions[product['product_id']] = position
+            bit = 1 << position
+            for facet, values in product_facet_values(product).items():
+                bitmap = self.bitmaps[facet]
+                for value in values:
+                    bitmap[value] = bitmap.get(value, 0) | bit
+        self.all_mask = (1 << len(self.positions)) - 1
+
+    def mask(self, filters, exclude=None):
+        mask = self.all_mask
+        for facet, values in (filters or {}).items():
+            if facet == exclude or facet not in self.bitmaps:
+                continue
+            facet_mask = 0
+            for value in values:
+                facet_mask |= self.bitmaps[facet].get(value, 0)
+            mask &= facet_mask
+        return mask
+
+    def mask_for_ids(self, product_ids):
+        mask = 0
+        for product_id in product_ids:
+            position = self.positions.get(product_id)
+            if position is not None:
+                mask |= 1 << position
+        return mask
+
+    def membership(self, mask):
+        return Membership(mask, self.positions)
+
+    def counts(self, filters=None, base_mask=None):
+        """Счетчики всех значений всех фасетов для текущего выбора"""
+        filters = filters or {}
+        base = self.all_mask if base_mask is None else base_mask
+        result = {}
+        for facet in FACETS:
+            others = self.mask(filters, exclude=facet) & base
+            selected = set(filters.get(facet, ()))
+            values = [
+                {'value': value, 'count': _popcount(bitmap & others), 'selected': value in selected}
+                for value, bitmap in self.bitmaps[facet].items()
+            ]
+            if facet == 'price':
+                order = {value: i for i, (value, _, _) in enumerate(PRICE_BUCKETS)}
+                values.sort(key=lambda item: order[item['value']])
+            elif facet == 'memory':
+                values.sort(key=lambda item: memory_sort_key(item['value']))
+            else:
+                values.sort(key=lambda item: (-item['count'], item['value']))
+            result[facet] = values
+        return result
+
+
+# Массив значений фасета в строке iphones_catalog (с подстановкой текущего значения, как в format_product)
+_FACET_SQL_ARRAYS = {
+    'color': "(CASE WHEN cardinality(ic.colors) > 0 THEN ic.colors ELSE ARRAY[ic.current_color] END)",
+    'memory': "(CASE WHEN cardinality(ic.memory_sizes) > 0 THEN ic.memory_sizes ELSE ARRAY[ic.current_memory] END)",
+    'sim': "(CASE WHEN cardinality(ic.sim_options) > 0 THEN ic.sim_options ELSE ARRAY[ic.current_sim] END)",
+}
+
+
+def facet_filters_sql(filters):
+    """Условия WHERE и параметры для выбранных фасетов"""
+    conditions = []
+    params = []
+    for facet, values in (filters or {}).items():
+        if facet == 'category':
+            conditions.append("ic.category = ANY(%s)")
+            params.append(list(values))
+        elif facet in _FACET_SQL_ARRAYS:
+            conditions.append(f"{_FACET_SQL_ARRAYS[facet]} && %s::text[]")
+            params.append(list(values))
+        elif facet == 'price_range':
+            min_price, max_price = values
+            if min_price is not None:
+                conditions.append("ic.price >= %s")
+                params.append(min_price)
+            if max_price is not None:
+                conditions.append("ic.price <= %s")
+                params.append(max_price)
+        elif facet == 'price':
+            ranges = []
+            for value, low, high in PRICE_BUCKETS:
+                if value not in values:
+                    continue
+                if high is None:
+                    ranges.append("ic.price >= %s")
+                    params.append(low)
+                else:
+                    ranges.append("(ic.price >= %s AND ic.price < %s)")
+                    params.extend([low, high])
+            conditions.append("(" + " OR ".join(ranges) + ")" if ranges else "FALSE")
+    return conditions, params
@@ -0,0 +1,95 @@
+# catalog_pagination.py
+import json
+import base64
+
+# Колонки сортировки; id в конце делает порядок однозначным при равных значениях
+SORT_ORDERS = {
+    'price_asc': (('price', 'ASC'), ('id', 'ASC')),
+    'price_desc': (('price', 'DESC'), ('id', 'ASC')),
+    'name': (('model', 'ASC'), ('id', 'ASC')),
+    'display_order': (('display_order', 'ASC'), ('id', 'ASC')),
+}
+
+# Текстовые колонки сортировки
+_TEXT_COLUMNS = {'model'}
+
+# Сортировка по релевантности не сводится к ключу строки, для нее курсор хранит смещение
+OFFSET_SORTS = {'relevance'}
+
+
+def resolve_sort(sort_by):
+    """Неизвестная сортировка, как и раньше, означает display_order"""
+    if sort_by in SORT_ORDERS or sort_by in OFFSET_SORTS:
+        return sort_by
+    return 'display_order'
+
+
+def cursor_values(sort_by, product):
+    """Значения колонок сортировки для товара"""
+    values = []
+    for column, _ in SORT_ORDERS[sort_by]:
+        value = product.get(column)
+        if value is None:
+            value = '' if column in _TEXT_COLUMNS else 0
+        values.append(value)
+    return values
+
+
+def sort_key(sort_by, values):
+    """Ключ для сравнения в Python, согласованный с ORDER BY"""
+    return tuple(-value if direction == 'DESC' else value for value, (_, direction) in zip(values, SORT_ORDERS[sort_by]))
+
+
+def encode_cursor(sort_by, values=None, offset=None):
+    payload = {'s': sort_by}
+    if offset is not None:
+        payload['o'] = offset
+    else:
+        payload['k'] = values
+    raw = json.dumps(payload, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, sort_by):
+    """Значения ключа (или смещение) из курсора; ValueError для чужого или битого курсора"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        payload = json.loads(raw.decode('utf-8'))
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(payload, dict) or payload.get('s') != sort_by:
+        raise ValueError("Cursor does not match sort order")
+
+    if sort_by in OFFSET_SORTS:
+        offset = payload.get('o')
+        if not isinstance(offset, int) or offset < 0:
+            raise ValueError("Invalid cursor")
+        return offset
+
+    values = payload.get('k')
+    columns = SORT_ORDERS[sort_by]
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise ValueError("Invalid cursor")
+    for value, (column, _) in zip(values, columns):
+        expected = str if column in _TEXT_COLUMNS else int
+        if not isinstance(value, expected) or isinstance(value, bool):
+            raise ValueError("Invalid cursor")
+    return values
+
+
+def order_by_sql(sort_by):
+    return ' ORDER BY ' + ', '.join(f'ic.{column} {direction}' for column, direction in SORT_ORDERS[sort_by])
+
+
+def keyset_sql(sort_by, values):
+    """Условие "строго после курсора" для WHERE и его параметры"""
+    clauses = []
+    params = []
+    columns = SORT_ORDERS[sort_by]
+    for i, (column, direction) in enumerate(columns):
+        parts = [f'ic.{prev} = %s' for prev, _ in columns[:i]]
+        params.extend(values[:i])
+        parts.append(f"ic.{column} {'<' if direction == 'DESC' else '>'} %s")
+        params.append(values[i])
+        clauses.append('(' + ' AND '.join(parts) + ')')
+    return '(' + ' OR '.join(clauses) + ')', params
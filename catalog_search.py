@@ -0,0 +1,148 @@
+# catalog_search.py
+import re
+from bisect import bisect_left
+
+_TOKEN_RE = re.compile(r'[^\W\d_]+|\d+')
+
+# Русские написания и сокращения приводим к латинским токенам каталога
+SYNONYMS = {
+    'айфон': 'iphone',
+    'айфоны': 'iphone',
+    'про': 'pro',
+    'макс': 'max',
+    'плюс': 'plus',
+    'мини': 'mini',
+    'эйр': 'air',
+    'эир': 'air',
+    'гб': 'gb',
+    'гигабайт': 'gb',
+    'тб': 'tb',
+    'терабайт': 'tb',
+    'сим': 'sim',
+    'есим': 'esim',
+    'черный': 'black',
+    'белый': 'white',
+    'синий': 'blue',
+    'голубой': 'blue',
+    'золотой': 'gold',
+    'серебристый': 'silver',
+    'серый': 'gray',
+    'grey': 'gray',
+    'розовый': 'pink',
+    'зеленый': 'green',
+    'фиолетовый': 'purple',
+    'красный': 'red',
+    'желтый': 'yellow',
+    'оранжевый': 'orange',
+    'титан': 'titanium',
+    'титановый': 'titanium',
+}
+
+# Вес совпадения по полю товара
+FIELD_WEIGHTS = {
+    'model': 3,
+    'memory': 2,
+    'color': 1,
+    'sim': 1,
+    'category': 1,
+}
+
+
+def _raw_tokens(text):
+    return _TOKEN_RE.findall((text or '').lower().replace('ё', 'е'))
+
+
+def tokenize(text):
+    """Нормализованные токены: нижний регистр, цифры отдельно от букв, синонимы"""
+    return [SYNONYMS.get(token, token) for token in _raw_tokens(text)]
+
+
+def _product_fields(product):
+    yield 'model', [product.get('model')]
+    yield 'color', [product.get('current_color')] + list(product.get('colors') or product.get('colors_list') or [])
+    yield 'memory', [product.get('current_memory')] + list(product.get('memory_sizes') or product.get('memory_list') or [])
+    yield 'sim', [product.get('current_sim')] + list(product.get('sim_options') or [])
+    yield 'category', [product.get('category')]
+
+
+def build_search_text(product):
+    """Нормализованная строка для поиска в базе (колонка search_text)"""
+    tokens = []
+    for _, values in _product_fields(product):
+        for value in values:
+            tokens.extend(tokenize(value))
+    return ' '.join(dict.fromkeys(tokens))
+
+
+def normalize_query(query):
+    """Каноническая форма запроса: у запросов с одинаковой формой одинаковые результаты"""
+    normalized = ' '.join(_raw_tokens(query))
+    if normalized and query[-1:].isspace():
+        normalized += ' '
+    return normalized
+
+
+class SearchIndex:
+    """Инвертированный индекс по модели, цветам, памяти, SIM и категории.
+
+    Все токены запроса должны найтись у товара; последний токен ищется
+    по префиксу, чтобы поиск работал по мере набора.
+    """
+
+    def __init__(self, products):
+        self._postings = {}
+        self._order = {}
+        for position, product in enumerate(products):
+            product_id = product['product_id']
+            self._order[product_id] = position
+            for field, values in _product_fields(product):
+                weight = FIELD_WEIGHTS[field]
+                for value in values:
+                    for token in tokenize(value):
+                        posting = self._postings.setdefault(token, {})
+                        if posting.get(product_id, 0) < weight:
+                            posting[product_id] = weight
+        self._vocabulary = sorted(self._postings)
+
+    def _expand(self, raw_token):
+        """Токены словаря, подходящие под префикс raw_token"""
+        candidates = set()
+        for prefix in (raw_token, SYNONYMS.get(raw_token, raw_token)):
+            i = bisect_left(self._vocabulary, prefix)
+            while i < len(self._vocabulary) and self._vocabulary[i].startswith(prefix):
+                candidates.add(self._vocabulary[i])
+                i += 1
+        for word, token in SYNONYMS.items():
+            if word.startswith(raw_token) and token in self._postings:
+                candidates.add(token)
+        return candidates
+
+    def search(self, query):
+        """product_id по убыванию релевантности или None, если в запросе нет токенов"""
+        raw_tokens = _raw_tokens(query)
+        if not raw_tokens:
+            return None
+
+        scores = None
+        for i, raw_token in enumerate(raw_tokens):
+            token = SYNONYMS.get(raw_token, raw_token)
+            is_prefix = i == len(raw_tokens) - 1 and not query[-1:].isspace()
+
+            matched = dict(self._postings.get(token, {}))
+            if is_prefix:
+                for candidate in self._expand(raw_token):
+                    if candidate == token:
+                        continue
+                    for product_id, weight in self._postings[candidate].items():
+                        # Точное совпадение весит больше совпадения по префиксу
+                        if product_id not in matched:
+                            matched[product_id] = weight * 0.5
+
+            if scores is None:
+                scores = matched
+            else:
+                scores = {product_id: scores[product_id] + weight for product_id, weight in matched.items() if product_id in scores}
+            if not scores:
+                return []
+
+        return sorted(scores, key=lambda product_id: (-scores[product_id], self._order[product_id]))
@@ -0,0 +1,64 @@
+# catalog_similar.py
+import re
+
+SIMILAR_LIMIT = 8
+
+_FAMILY_RE = re.compile(r'^(.*?\d+)', re.UNICODE)
+
+
+def product_family(product):
+    """Линейка товара: категория, а если ее нет - модель до номера поколения ("iPhone 16")"""
+    if product.get('category'):
+        return product['category'].lower()
+    model = (product.get('model') or '').strip().lower()
+    match = _FAMILY_RE.match(model)
+    return match.group(1) if match else model
+
+
+def _score(product, other):
+    score = 0.0
+    if product.get('category') and product.get('category') == other.get('category'):
+        score += 2
+    if product['_family'] == other['_family']:
+        score += 2
+    score += 0.5 * len(product['_memory'] & other['_memory'])
+    # Штраф за относительную разницу в цене
+    price = product.get('price') or 0
+    score -= abs(price - (other.get('price') or 0)) / max(price, 1)
+    return score
+
+
+def compute_similar(products, limit=SIMILAR_LIMIT):
+    """Для каждого product_id - список product_id ближайших товаров (без самого товара)"""
+    prepared = []
+    for product in products:
+        prepared.append({
+            'product_id': product['product_id'],
+            'category': product.get('category'),
+            'price': product.get('price') or 0,
+            '_family': product_family(product),
+            '_memory': set(product.get('memory_sizes') or product.get('memory_list') or []),
+        })
+
+    # Кандидаты: та же линейка и соседи по цене, чтобы не сравнивать каждый с каждым
+    by_family = {}
+    for product in prepared:
+        by_family.setdefault(product['_family'], []).append(product)
+    by_price = sorted(prepared, key=lambda product: (product['price'], product['product_id']))
+    price_position = {product['product_id']: i for i, product in enumerate(by_price)}
+    window = limit * 2
+
+    similar = {}
+    for product in prepared:
+        position = price_position[product['product_id']]
+        candidates = {other['product_id']: other for other in by_family[product['_family']]}
+        for other in by_price[max(0, position - window):position + window + 1]:
+            candidates[other['product_id']] = other
+        candidates.pop(product['product_id'], None)
+
+        ranked = sorted(
+            candidates.values(),
+            key=lambda other: (-_score(product, other), abs(product['price'] - other['price']), other['product_id']),
+        )
+        similar[product['product_id']] = [other['product_id'] for other in ranked[:limit]]
+    return similar
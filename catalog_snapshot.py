@@ -0,0 +1,292 @@
+# catalog_snapshot.py
+import os
+import time
+import logging
+import threading
+from bisect import bisect_left, bisect_right
+
+from catalog_facets import FACETS, FacetIndex
+from catalog_search import SearchIndex
+from catalog_similar import compute_similar
+from catalog_pagination import (
+    OFFSET_SORTS, SORT_ORDERS, cursor_values, decode_cursor, encode_cursor, resolve_sort, sort_key,
+)
+
+logger = logging.getLogger(__name__)
+
+# Товары читаются из одной таблицы: массивы colors и memory_sizes
+# заполняет save_catalog(), так что JOIN и GROUP BY не нужны
+PRODUCTS_QUERY = 'SELECT ic.* FROM iphones_catalog ic'
+
+# Полный каталог в порядке display_order
+CATALOG_QUERY = PRODUCTS_QUERY + ' ORDER BY ic.display_order ASC, ic.id ASC'
+
+VERSION_QUERY = 'SELECT version FROM catalog_meta WHERE id = 1'
+
+# Версия вместе со временем обновления (для Last-Modified)
+META_QUERY = 'SELECT version, updated_at FROM catalog_meta WHERE id = 1'
+
+# Счетчики, которые save_catalog() обновляет вместе с версией
+COUNTS_QUERY = 'SELECT version, product_count, category_counts FROM catalog_meta WHERE id = 1'
+
+
+# Поля для отображения; save_catalog() сохраняет их в строке при загрузке каталога
+DERIVED_FIELDS = ('formatted_price', 'short_model', 'colors_list', 'memory_list', 'all_colors', 'all_memory')
+
+
+def derived_fields(product):
+    """Поля для отображения (цена, короткое имя, списки цветов и памяти) по сырым полям товара"""
+    model = product.get('model') or ''
+    colors = product.get('colors')
+    memory_sizes = product.get('memory_sizes')
+    return {
+        'formatted_price': f"{product.get('price') or 0:,} руб.".replace(',', ' '),
+        'short_model': model[:30] + '...' if len(model) > 30 else model,
+        'colors_list': list(colors) if colors else ([product['current_color']] if product.get('current_color') else []),
+        'memory_list': list(memory_sizes) if memory_sizes else ([product['current_memory']] if product.get('current_memory') else []),
+        # Прежние строковые поля API
+        'all_colors': ','.join(colors) if colors else None,
+        'all_memory': ','.join(memory_sizes) if memory_sizes else None,
+    }
+
+
+def format_product(product):
+    """Товар с полями для отображения.
+
+    Обычно они уже лежат в строке (посчитаны при загрузке каталога);
+    считаем только для строк, загруженных до появления этих колонок.
+    """
+    if product.get('formatted_price') is None:
+        product.update(derived_fields(product))
+    return product
+
+
+class CatalogSnapshot:
+    """Неизменяемый снимок каталога для одной версии.
+
+    Словари товаров общие для всех запросов: списки, которые возвращает
+    снимок, нельзя изменять, для изменения берите копию через get_product().
+    """
+
+    def __init__(self, version, products, updated_at=None):
+        self.version = version
+        self.updated_at = updated_at
+        self.loaded_at = time.time()
+        self.products = tuple(products)
+        self.by_id = {product['product_id']: product for product in self.products}
+
+        # Строки, загруженные до появления similar_ids, досчитываем при сборке снимка
+        if any(product.get('similar_ids') is None for product in self.products):
+            similar = compute_similar(self.products)
+            for product in self.products:
+                if product.get('similar_ids') is None:
+                    product['similar_ids'] = similar.get(product['product_id'], [])
+
+        # Предвычисленные сортировки и их ключи для поиска позиции курсора
+        self.orderings = {}
+        self.ordering_keys = {}
+        for sort_by in SORT_ORDERS:
+            keyed = sorted(
+                ((sort_key(sort_by, cursor_values(sort_by, product)), product) for product in self.products),
+                key=lambda item: item[0],
+            )
+            self.ordering_keys[sort_by] = [key for key, _ in keyed]
+            self.orderings[sort_by] = tuple(product for _, product in keyed)
+
+        counts = {}
+        for product in self.products:
+            counts[product['category']] = counts.get(product['category'], 0) + 1
+        self.category_counts = counts
+        self.categories = tuple(
+            {'name': name, 'count': count}
+            for name, count in sorted(counts.items(), key=lambda item: (-item[1], item[0] or ''))
+        )
+
+        # Отсортированные цены для двоичного поиска диапазона в orderings['price_asc']
+        self.sorted_prices = [product['price'] or 0 for product in self.orderings['price_asc']]
+
+        self.featured = tuple(p for p in self.orderings['price_desc'] if p.get('is_featured') == 1)
+
+        self.search_index = SearchIndex(self.orderings['display_order'])
+        self.facet_index = FacetIndex(self.orderings['display_order'])
+
+    def price_slice(self, min_price=None, max_price=None):
+        """Границы [lo, hi) товаров с ценой в диапазоне внутри orderings['price_asc']"""
+        lo = bisect_left(self.sorted_prices, min_price) if min_price is not None else 0
+        hi = bisect_right(self.sorted_prices, max_price) if max_price is not None else len(self.sorted_prices)
+        return lo, max(lo, hi)
+
+    def _base_mask(self, search=None, filters=None):
+        """Маска поиска и диапазона цен (None - без ограничений) и ранжирование поиска"""
+        mask = None
+        price_range = (filters or {}).get('price_range')
+        if price_range:
+            lo, hi = self.price_slice(*price_range)
+            mask = self.facet_index.mask_for_ids(p['product_id'] for p in self.orderings['price_asc'][lo:hi])
+
+        ranked = self.search_index.search(search) if search else None
+        if ranked is not None:
+            search_mask = self.facet_index.mask_for_ids(ranked)
+            mask = search_mask if mask is None else mask & search_mask
+        return mask, ranked
+
+    def _selection(self, category=None, search=None, filters=None):
+        """Отобранные товары (Membership или None - все) и ранжирование поиска"""
+        filters = dict(filters or {})
+        if category and category != 'all':
+            filters['category'] = (category,)
+
+        mask, ranked = self._base_mask(search, filters)
+        if any(facet in FACETS for facet in filters):
+            facet_mask = self.facet_index.mask(filters)
+            mask = facet_mask if mask is None else mask & facet_mask
+        return (self.facet_index.membership(mask) if mask is not None else None), ranked
+
+    def get_all_products(self, category=None, sort_by='price_desc', search=None, filters=None):
+        sort_by = resolve_sort(sort_by)
+        selected, ranked = self._selection(category, search, filters)
+
+        if sort_by == 'relevance' and ranked is not None:
+            products = [self.by_id[product_id] for product_id in ranked]
+        else:
+            products = self.orderings.get(sort_by, self.orderings['display_order'])
+        if selected is not None:
+            products = [p for p in products if p['product_id'] in selected]
+        return list(products)
+
+    def get_products_page(self, category=None, sort_by='price_desc', search=None, limit=50, cursor=None, filters=None):
+        """Страница товаров после курсора и курсор следующей страницы (или None)"""
+        sort_by = resolve_sort(sort_by)
+        if sort_by in OFFSET_SORTS:
+            products = self.get_all_products(category, sort_by, search, filters)
+            offset = decode_cursor(cursor, sort_by) if cursor else 0
+            end = offset + limit
+            next_cursor = encode_cursor(sort_by, offset=end) if end < len(products) else None
+            return products[offset:end], next_cursor
+
+        ordering = self.orderings[sort_by]
+        start, stop = 0, len(ordering)
+        if cursor:
+            after = sort_key(sort_by, decode_cursor(cursor, sort_by))
+            start = bisect_right(self.ordering_keys[sort_by], after)
+
+        # При сортировке по цене диапазон цен - это непрерывный отрезок сортировки
+        price_range = (filters or {}).get('price_range')
+        if price_range and sort_by in ('price_asc', 'price_desc'):
+            lo, hi = self.price_slice(*price_range)
+            if sort_by == 'price_desc':
+                lo, hi = len(ordering) - hi, len(ordering) - lo
+            start, stop = max(start, lo), hi
+
+        selected, _ = self._selection(category, search, filters)
+
+        page = []
+        for i in range(start, stop):
+            product = ordering[i]
+            if selected is not None and product['product_id'] not in selected:
+                continue
+            page.append(product)
+            if len(page) > limit:
+                break
+
+        next_cursor = None
+        if len(page) > limit:
+            page = page[:limit]
+            next_cursor = encode_cursor(sort_by, cursor_values(sort_by, page[-1]))
+        return page, next_cursor
+
+    def get_facets(self, category=None, search=None, filters=None):
+        """Счетчики фасетов для текущего выбора за один проход по битовым маскам"""
+        filters = dict(filters or {})
+        if category and category != 'all':
+            filters['category'] = (category,)
+        base_mask, _ = self._base_mask(search, filters)
+        return self.facet_index.counts(filters, base_mask)
+
+    def get_categories(self):
+        return [dict(category) for category in self.categories]
+
+    def get_featured_products(self, limit=6):
+        return list(self.featured[:limit])
+
+    def get_product_count(self, category=None, search=None, filters=None):
+        if filters or (search and self.search_index.search(search) is not None):
+            return len(self.get_all_products(category, 'display_order', search, filters))
+        if category and category != 'all':
+            return self.category_counts.get(category, 0)
+        return len(self.products)
+
+    def get_product(self, product_id):
+        product = self.by_id.get(product_id)
+        return dict(product) if product else None
+
+
+class CatalogSnapshotStore:
+    """Хранит текущий снимок каталога и подменяет его при смене версии.
+
+    Версию (catalog_meta.version) повышает iPhoneDatabase.save_catalog().
+    Воркер проверяет её не чаще раза в check_interval секунд одним
+    легким запросом и перечитывает каталог только если версия изменилась.
+    """
+
+    def __init__(self, db_pool, check_interval=2.0):
+        self.db_pool = db_pool
+        self.check_interval = check_interval
+        self._snapshot = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, db_pool):
+        return cls(db_pool, check_interval=float(os.environ.get('CATALOG_VERSION_CHECK_INTERVAL', 2)))
+
+    def _read_version(self, cursor):
+        cursor.execute(VERSION_QUERY)
+        row = cursor.fetchone()
+        return row[0] if row else 0
+
+    def _load(self):
+        with self.db_pool.cursor() as cursor:
+            # Версию читаем до данных: если каталог обновится между запросами,
+            # следующая проверка увидит новую версию и перечитает снимок.
+            cursor.execute(META_QUERY)
+            version, updated_at = cursor.fetchone() or (0, None)
+            cursor.execute(CATALOG_QUERY)
+            columns = [column[0] for column in cursor.description]
+            products = [format_product(dict(zip(columns, row))) for row in cursor.fetchall()]
+        logger.info("Catalog snapshot v%s loaded: %d products", version, len(products))
+        return CatalogSnapshot(version, products, updated_at)
+
+    def get(self):
+        """Текущий снимок; при необходимости проверяет версию и перечитывает каталог."""
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() - self._checked_at < self.check_interval:
+            return snapshot
+
+        # Проверку выполняет один поток, остальные пока отдают старый снимок
+        if not self._lock.acquire(blocking=snapshot is None):
+            return snapshot
+        try:
+            snapshot = self._snapshot
+            if snapshot is not None and time.monotonic() - self._checked_at < self.check_interval:
+                return snapshot
+            if snapshot is None:
+                self._snapshot = snapshot = self._load()
+                self._checked_at = time.monotonic()
+                return snapshot
+            try:
+                with self.db_pool.cursor() as cursor:
+                    version = self._read_version(cursor)
+                if version != snapshot.version:
+                    self._snapshot = snapshot = self._load()
+            except Exception as e:
+                # Пока база недоступна, отдаем последний загруженный снимок
+                logger.warning("Catalog version check failed, serving v%s: %s", snapshot.version, e)
+            self._checked_at = time.monotonic()
+            return snapshot
+        finally:
+            self._lock.release()
+
+    def invalidate(self):
+        """Принудительная перепроверка версии при следующем обращении."""
+        self._checked_at = 0.0
@@ -0,0 +1,45 @@
+# coinbase_async.py
+import os
+
+import httpx
+
+from coinbase_client import COINBASE_API_URL, CoinbaseError, api_headers, parse_charge
+
+
+class AsyncCommerceClient:
+    """Async counterpart of coinbase_client.CommerceClient over a pooled httpx.AsyncClient."""
+
+    def __init__(self, api_key, base_url=None, timeout=10.0, connect_timeout=3.0, max_connections=100):
+        self.base_url = (base_url or COINBASE_API_URL).rstrip('/')
+        self._http = httpx.AsyncClient(
+            base_url=self.base_url,
+            headers=api_headers(api_key),
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+    @classmethod
+    def from_env(cls):
+        api_key = os.environ.get('COINBASE_COMMERCE_API_KEY')
+        if not api_key:
+            return None
+        return cls(
+            api_key,
+            base_url=os.environ.get('COINBASE_API_URL'),
+            timeout=float(os.environ.get('COINBASE_TIMEOUT', 10)),
+            connect_timeout=float(os.environ.get('COINBASE_CONNECT_TIMEOUT', 3)),
+        )
+
+    async def create_charge(self, **charge_info):
+        try:
+            response = await self._http.post('/charges', json=charge_info)
+        except httpx.HTTPError as e:
+            raise CoinbaseError(f"Coinbase Commerce request failed: {e}") from e
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+        return parse_charge(response.status_code, body, response.text)
+
+    async def aclose(self):
+        await self._http.aclose()
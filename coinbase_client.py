@@ -0,0 +1,77 @@
+# coinbase_client.py
+import os
+from collections import namedtuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+COINBASE_API_URL = 'https://api.commerce.coinbase.com'
+COINBASE_API_VERSION = '2018-03-22'
+
+Charge = namedtuple('Charge', ['code', 'hosted_url', 'data'])
+
+
+class CoinbaseError(Exception):
+    """Coinbase Commerce returned an error or could not be reached."""
+
+
+def api_headers(api_key):
+    return {
+        'X-CC-Api-Key': api_key,
+        'X-CC-Version': COINBASE_API_VERSION,
+        'Content-Type': 'application/json',
+        'Accept': 'application/json',
+    }
+
+
+def parse_charge(status_code, body, text):
+    """Charge from a /charges response, or CoinbaseError for an error response."""
+    if status_code >= 400:
+        message = (body or {}).get('error', {}).get('message') or text
+        raise CoinbaseError(f"Coinbase Commerce error {status_code}: {message}")
+    data = body['data']
+    return Charge(code=data['code'], hosted_url=data['hosted_url'], data=data)
+
+
+class CommerceClient:
+    """Coinbase Commerce client for the Flask views.
+
+    Keeps a pool of keep-alive connections (no TLS handshake per checkout)
+    and bounds every request with connect/read timeouts, so a slow Coinbase
+    response costs a worker at most `timeout` seconds.
+    """
+
+    def __init__(self, api_key, base_url=None, timeout=10.0, connect_timeout=3.0, max_connections=10):
+        self.base_url = (base_url or COINBASE_API_URL).rstrip('/')
+        self.timeout = (connect_timeout, timeout)
+        self._http = requests.Session()
+        self._http.headers.update(api_headers(api_key))
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_connections)
+        self._http.mount('https://', adapter)
+        self._http.mount('http://', adapter)
+
+    @classmethod
+    def from_env(cls):
+        api_key = os.environ.get('COINBASE_COMMERCE_API_KEY')
+        if not api_key:
+            return None
+        return cls(
+            api_key,
+            base_url=os.environ.get('COINBASE_API_URL'),
+            timeout=float(os.environ.get('COINBASE_TIMEOUT', 10)),
+            connect_timeout=float(os.environ.get('COINBASE_CONNECT_TIMEOUT', 3)),
+        )
+
+    def create_charge(self, **charge_info):
+        try:
+            response = self._http.post(f'{self.base_url}/charges', json=charge_info, timeout=self.timeout)
+        except requests.RequestException as e:
+            raise CoinbaseError(f"Coinbase Commerce request failed: {e}") from e
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+        return parse_charge(response.status_code, body, response.text)
+
+    def close(self):
+        self._http.close()
@@ -0,0 +1,198 @@
+# db_pool.py
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions, pool
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection could be checked out within the timeout."""
+
+
+class ConnectionPool:
+    """Thread-safe Postgres connection pool shared by the whole app.
+
+    Wraps psycopg2's ThreadedConnectionPool with a bounded checkout wait,
+    a health check on borrow and simple usage statistics.
+    """
+
+    def __init__(self, dsn, minconn=1, maxconn=10, timeout=5.0, health_check_interval=30.0):
+        if minconn > maxconn:
+            raise ValueError("minconn must not exceed maxconn")
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+
+        self._pool = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._last_used = {}
+        self._stats = {
+            'checkouts': 0,
+            'timeouts': 0,
+            'health_checks': 0,
+            'reconnects': 0,
+            'wait_time_total': 0.0,
+            'in_use': 0,
+            'max_in_use': 0,
+        }
+
+    @classmethod
+    def from_env(cls, dsn=None, reserved=0):
+        """Build a pool from DATABASE_URL and the DB_POOL_* environment variables.
+
+        `reserved` connections of the DB_POOL_MAX budget are left to another
+        pool of the same process (the asyncpg pool in asgi.py).
+        """
+        maxconn = int(os.environ.get('DB_POOL_MAX', 10)) - reserved
+        if maxconn < 1:
+            raise ValueError("DB_POOL_MAX leaves no connections for the pool")
+        return cls(
+            dsn or os.environ.get('DATABASE_URL'),
+            minconn=min(int(os.environ.get('DB_POOL_MIN', 1)), maxconn),
+            maxconn=maxconn,
+            timeout=float(os.environ.get('DB_POOL_TIMEOUT', 5)),
+            health_check_interval=float(os.environ.get('DB_POOL_HEALTH_CHECK_INTERVAL', 30)),
+        )
+
+    def _get_pool(self):
+        # The underlying pool is opened lazily so that create_app() does not
+        # need a reachable database and forked workers get their own sockets.
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    if not self.dsn:
+                        raise Exception("DATABASE_URL environment variable not set")
+                    self._pool = pool.ThreadedConnectionPool(self.minconn, self.maxconn, self.dsn)
+        return self._pool
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+        last_used = self._last_used.get(id(conn))
+        if last_used is None:
+            # Just opened by the pool: nothing to check yet
+            self._last_used[id(conn)] = time.monotonic()
+            return True
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        with self._lock:
+            self._stats['health_checks'] += 1
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        """Check out a connection, waiting at most `timeout` seconds."""
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._stats['timeouts'] += 1
+            raise PoolTimeout(f"No database connection available within {self.timeout}s")
+
+        try:
+            db_pool = self._get_pool()
+            # After a database restart every idle connection may be broken;
+            # replacements are checked too, until a newly opened one comes up
+            for _ in range(self.maxconn + 1):
+                conn = db_pool.getconn()
+                if self._is_healthy(conn):
+                    break
+                logger.warning("Discarding broken pooled connection")
+                self._last_used.pop(id(conn), None)
+                db_pool.putconn(conn, close=True)
+                with self._lock:
+                    self._stats['reconnects'] += 1
+            else:
+                raise psycopg2.OperationalError("No healthy database connection in the pool")
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._stats['checkouts'] += 1
+            self._stats['wait_time_total'] += time.monotonic() - started
+            self._stats['in_use'] += 1
+            self._stats['max_in_use'] = max(self._stats['max_in_use'], self._stats['in_use'])
+        return conn
+
+    def putconn(self, conn, close=False):
+        """Return a connection to the pool, discarding it if it is unusable."""
+        try:
+            if not conn.closed and conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except psycopg2.Error:
+            close = True
+        if not (close or conn.closed):
+            self._last_used[id(conn)] = time.monotonic()
+        try:
+            self._get_pool().putconn(conn, close=close or bool(conn.closed))
+        finally:
+            # The pool also closes connections above minconn; id() of a closed
+            # connection may be reused by a new one
+            if conn.closed:
+                self._last_used.pop(id(conn), None)
+            with self._lock:
+                self._stats['in_use'] -= 1
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection; commit on success, roll back on error."""
+        conn = self.getconn()
+        broken = False
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+            raise
+        finally:
+            self.putconn(conn, close=broken)
+
+    @contextmanager
+    def cursor(self):
+        """Shortcut for a cursor on a borrowed connection."""
+        with self.connection() as conn:
+            with conn.cursor() as cursor:
+                yield cursor
+
+    def stats(self):
+        """Snapshot of pool usage counters."""
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update({
+            'minconn': self.minconn,
+            'maxconn': self.maxconn,
+            'timeout': self.timeout,
+            'idle': len(self._pool._pool) if self._pool is not None else 0,
+            'open': len(self._pool._pool) + len(self._pool._used) if self._pool is not None else 0,
+        })
+        if stats['checkouts']:
+            stats['avg_wait_ms'] = round(stats['wait_time_total'] / stats['checkouts'] * 1000, 3)
+        else:
+            stats['avg_wait_ms'] = 0.0
+        return stats
+
+    def closeall(self):
+        """Close every pooled connection."""
+        with self._lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+            self._last_used.clear()
@@ -0,0 +1,169 @@
+# fake_coinbase.py
+"""Local stand-in for the Coinbase Commerce API, for offline checkout load tests.
+
+    python fake_coinbase.py --port 8765 --latency 0.2
+    COINBASE_API_URL=http://127.0.0.1:8765 COINBASE_COMMERCE_API_KEY=test gunicorn wsgi:app
+
+POST /charges answers like Coinbase (after --latency seconds, failing with
+--error-rate probability) and GET /pay/<code> plays the hosted checkout page.
+With --webhook-url and --webhook-secret every charge is later confirmed with
+a signed charge:confirmed webhook, exercising the full payment path.
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import random
+import string
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.request import Request, urlopen
+
+
+def _charge_code():
+    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
+
+
+def _now():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class FakeCoinbase:
+    def __init__(self, base_url, latency=0.0, error_rate=0.0, webhook_url=None, webhook_secret=None, webhook_delay=1.0):
+        self.base_url = base_url
+        self.latency = latency
+        self.error_rate = error_rate
+        self.webhook_url = webhook_url
+        self.webhook_secret = webhook_secret
+        self.webhook_delay = webhook_delay
+        self.charges = {}
+        self.lock = threading.Lock()
+
+    def create_charge(self, charge_info):
+        code = _charge_code()
+        charge = dict(
+            charge_info,
+            id=str(uuid.uuid4()),
+            code=code,
+            hosted_url=f'{self.base_url}/pay/{code}',
+            created_at=_now(),
+            timeline=[{'status': 'NEW', 'time': _now()}],
+        )
+        with self.lock:
+            self.charges[code] = charge
+        if self.webhook_url and self.webhook_secret:
+            timer = threading.Timer(self.webhook_delay, self.send_webhook, args=(charge, 'charge:confirmed'))
+            timer.daemon = True
+            timer.start()
+        return charge
+
+    def send_webhook(self, charge, event_type):
+        body = json.dumps({
+            'id': str(uuid.uuid4()),
+            'scheduled_for': _now(),
+            'event': {
+                'id': str(uuid.uuid4()),
+                'type': event_type,
+                'api_version': '2018-03-22',
+                'created_at': _now(),
+                'data': charge,
+            },
+        }).encode('utf-8')
+        signature = hmac.new(self.webhook_secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+        request = Request(self.webhook_url, data=body, method='POST', headers={
+            'Content-Type': 'application/json',
+            'X-CC-Webhook-Signature': signature,
+        })
+        try:
+            with urlopen(request, timeout=10) as response:
+                print(f"webhook {event_type} {charge['code']} -> {response.status}")
+        except Exception as e:
+            print(f"webhook {event_type} {charge['code']} failed: {e}")
+
+
+def make_handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _send(self, status, body, content_type='application/json'):
+            payload = body.encode('utf-8') if isinstance(body, str) else json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            if self.path.rstrip('/') != '/charges':
+                self._send(404, {'error': {'type': 'not_found', 'message': 'Not found'}})
+                return
+            if not self.headers.get('X-CC-Api-Key'):
+                self._send(401, {'error': {'type': 'authorization_error', 'message': 'No API key provided'}})
+                return
+            if fake.latency:
+                time.sleep(fake.latency)
+            if random.random() < fake.error_rate:
+                self._send(503, {'error': {'type': 'service_unavailable', 'message': 'Fake outage'}})
+                return
+            try:
+                charge_info = json.loads(body or b'{}')
+            except ValueError:
+                self._send(400, {'error': {'type': 'invalid_request', 'message': 'Invalid JSON'}})
+                return
+            self._send(201, {'data': fake.create_charge(charge_info)})
+
+        def do_GET(self):
+            if not self.path.startswith('/pay/'):
+                self._send(404, {'error': {'type': 'not_found', 'message': 'Not found'}})
+                return
+            with fake.lock:
+                charge = fake.charges.get(self.path[len('/pay/'):])
+            if charge is None:
+                self._send(404, 'Unknown charge', 'text/plain; charset=utf-8')
+                return
+            self._send(200, (
+                f"<h1>Fake Coinbase checkout {charge['code']}</h1>"
+                f"<p>{charge.get('name', '')}: {charge.get('local_price', {}).get('amount')} "
+                f"{charge.get('local_price', {}).get('currency')}</p>"
+                f"<p><a href=\"{charge.get('redirect_url', '')}\">Return to the store</a></p>"
+            ), 'text/html; charset=utf-8')
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fake Coinbase Commerce API for local load tests.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds before answering POST /charges")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of charges answered with 503")
+    parser.add_argument('--webhook-url', help="e.g. http://127.0.0.1:5000/webhooks/coinbase")
+    parser.add_argument('--webhook-secret', help="same value as the app's COINBASE_WEBHOOK_SECRET")
+    parser.add_argument('--webhook-delay', type=float, default=1.0)
+    args = parser.parse_args(argv)
+
+    fake = FakeCoinbase(
+        f'http://{args.host}:{args.port}',
+        latency=args.latency,
+        error_rate=args.error_rate,
+        webhook_url=args.webhook_url,
+        webhook_secret=args.webhook_secret,
+        webhook_delay=args.webhook_delay,
+    )
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(fake))
+    print(f"Fake Coinbase Commerce listening on {fake.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
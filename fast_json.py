@@ -0,0 +1,29 @@
+# fast_json.py
+import json
+import uuid
+import decimal
+from datetime import date
+
+from werkzeug.http import http_date
+
+# orjson необязателен: без него используется стандартный json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(value):
+    """Типы, которые не сериализуются напрямую; даты - как у jsonify"""
+    if isinstance(value, date):
+        return http_date(value)
+    if isinstance(value, (decimal.Decimal, uuid.UUID)):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(obj):
+    """JSON в байтах (UTF-8), готовый для тела ответа"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
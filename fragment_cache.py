@@ -0,0 +1,59 @@
+# fragment_cache.py
+import threading
+from collections import OrderedDict
+
+# Метки в закэшированном HTML, вместо которых подставляются части конкретной сессии
+CART_BADGE_MARKER = '<!--fragment:cart_badge-->'
+FLASHES_MARKER = '<!--fragment:flashes-->'
+
+
+class FragmentCache:
+    """LRU-кэш готовых ответов: отрендеренных страниц и закодированного JSON.
+
+    Ключ включает версию каталога, поэтому после обновления каталога
+    старые записи просто перестают запрашиваться и вытесняются.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            html = self._entries.get(key)
+            if html is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return html
+
+    def set(self, key, html):
+        with self._lock:
+            self._entries[key] = html
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_render(self, key, render):
+        html = self.get(key)
+        if html is None:
+            html = render()
+            self.set(key, html)
+        return html
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
@@ -0,0 +1,89 @@
+# http_cache.py
+import os
+import hashlib
+from datetime import timezone
+
+from flask.sessions import SecureCookieSessionInterface
+
+# Политики кэширования по endpoint; всё, чего нет в списке, не кэшируется
+PAGE = 'page'
+API = 'api'
+STATIC = 'static'
+
+CACHE_POLICIES = {
+    'index': PAGE,
+    'catalog_page': PAGE,
+    'product_detail': PAGE,
+    'api_products': API,
+    'api_categories': API,
+    'api_facets': API,
+    'static': STATIC,
+}
+
+NO_STORE = 'no-cache, no-store, must-revalidate'
+STATIC_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def make_etag(*parts):
+    """Значение ETag из версии каталога и прочих составляющих ответа"""
+    digest = hashlib.sha1('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()[:20]
+    return digest
+
+
+def to_utc(value):
+    """Время из catalog_meta (без зоны, считаем UTC) для Last-Modified"""
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc, microsecond=0)
+    return value.astimezone(timezone.utc).replace(microsecond=0)
+
+
+def is_not_modified(request, etag, last_modified=None):
+    """Можно ли ответить 304 на условный запрос"""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if last_modified is not None and request.if_modified_since is not None:
+        return last_modified <= request.if_modified_since
+    return False
+
+
+def api_cache_control(cdn_max_age):
+    """Публичный ответ API: браузер всегда перепроверяет, CDN может держать cdn_max_age секунд"""
+    if cdn_max_age:
+        return f'public, max-age=0, s-maxage={cdn_max_age}, must-revalidate'
+    return 'public, no-cache'
+
+
+class PrivateCookieSessionInterface(SecureCookieSessionInterface):
+    """Сессия в подписанной cookie, как обычно во Flask.
+
+    Cookie ставится уже после after_request, поэтому здесь, последним шагом,
+    ответ с Set-Cookie перестает быть public: общий кэш не должен раздавать
+    чужую сессию.
+    """
+
+    def save_session(self, app, session, response):
+        super().save_session(app, session, response)
+        if 'Set-Cookie' in response.headers and response.cache_control.public:
+            response.headers['Cache-Control'] = 'private, no-cache'
+
+
+class StaticVersions:
+    """Параметр ?v= для url_for('static'), чтобы статика кэшировалась навсегда"""
+
+    def __init__(self, static_folder):
+        self.static_folder = static_folder
+        self._versions = {}
+
+    def get(self, filename):
+        version = self._versions.get(filename)
+        if version is None:
+            path = os.path.join(self.static_folder, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return None
+            version = make_etag(filename, stat.st_mtime_ns, stat.st_size)[:10]
+            self._versions[filename] = version
+        return version
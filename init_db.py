@@ -1,4 +1,6 @@
-from web_db_setup import setup_database
+import sys
+
+from migrate import main
 
 if __name__ == '__main__':
-    setup_database()
+    sys.exit(main())
@@ -0,0 +1,120 @@
+# migrate.py
+"""One-shot schema migration and catalog ingest.
+
+Run once per deploy (Vercel postBuild, Render build command) instead of on
+every worker boot:
+
+    python migrate.py                 # migrate schema, ingest site-html.txt if it changed
+    python migrate.py --skip-ingest   # schema only
+    python migrate.py --force-ingest  # re-ingest even if site-html.txt is unchanged
+
+Concurrent runs are serialized with a Postgres advisory lock, so parallel
+deploys cannot race to migrate or re-ingest the same catalog.
+"""
+import argparse
+import hashlib
+import logging
+import os
+import sys
+from contextlib import contextmanager
+
+import psycopg2
+from dotenv import load_dotenv
+
+from web_db_setup import SCHEMA_VERSION, get_schema_version, setup_database
+
+load_dotenv()
+
+# Arbitrary application-wide key for pg_advisory_lock
+MIGRATION_LOCK_ID = 7_203_501
+
+CATALOG_SOURCE = 'site-html.txt'
+
+
+@contextmanager
+def migration_lock(conn):
+    """Holds the session-level advisory lock, waiting for any other migration to finish."""
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT pg_try_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+        if not cursor.fetchone()[0]:
+            logging.info("Another migration is running, waiting for it to finish...")
+            cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+    try:
+        yield
+    finally:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+
+
+def source_hash(path=CATALOG_SOURCE):
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+def ingested_hash(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT source_hash FROM catalog_meta WHERE id = 1")
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def ingest(conn, force=False):
+    """Parses and saves the catalog unless this exact source was already ingested."""
+    # Imported here so a schema-only run does not need BeautifulSoup
+    from parsing import main_catalog
+
+    current = source_hash()
+    if current is None:
+        logging.warning(f"{CATALOG_SOURCE} not found, skipping catalog ingest")
+        return False
+    if not force and ingested_hash(conn) == current:
+        logging.info("Catalog source unchanged, skipping ingest")
+        return False
+
+    if not main_catalog():
+        raise Exception("Catalog ingest failed")
+    with conn.cursor() as cursor:
+        cursor.execute("UPDATE catalog_meta SET source_hash = %s WHERE id = 1", (current,))
+    logging.info("Catalog ingested")
+    return True
+
+
+def migrate(db_url, skip_ingest=False, force_ingest=False):
+    conn = psycopg2.connect(db_url)
+    try:
+        with migration_lock(conn):
+            with conn.cursor() as cursor:
+                version = get_schema_version(cursor)
+            if version == SCHEMA_VERSION:
+                logging.info(f"Schema is up to date (version {version})")
+            else:
+                logging.info(f"Migrating schema from version {version} to {SCHEMA_VERSION}")
+                setup_database()
+
+            if not skip_ingest:
+                ingest(conn, force=force_ingest)
+    finally:
+        conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Migrate the database schema and ingest the catalog.")
+    parser.add_argument('--skip-ingest', action='store_true', help="only migrate the schema")
+    parser.add_argument('--force-ingest', action='store_true', help="ingest even if the catalog source is unchanged")
+    args = parser.parse_args(argv)
+
+    db_url = os.environ.get('DATABASE_URL')
+    if not db_url:
+        logging.error("DATABASE_URL environment variable not set")
+        return 1
+    migrate(db_url, skip_ingest=args.skip_ingest, force_ingest=args.force_ingest)
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
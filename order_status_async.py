@@ -0,0 +1,104 @@
+# order_status_async.py
+import asyncio
+import logging
+
+import asyncpg
+
+from order_status_feed import RESYNC
+from webhook_events import ORDER_STATUS_CHANNEL
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncOrderStatusFeed:
+    """Order status changes for the ASGI serving mode (see asgi.py).
+
+    Same job as order_status_feed.OrderStatusFeed, on the event loop: one
+    dedicated asyncpg LISTEN connection per process, and a queue per open
+    stream receiving '<status>' or RESYNC, so a waiting stream holds no thread.
+    """
+
+    def __init__(self, dsn, reconnect_delay=1.0, ping_interval=60.0):
+        self.dsn = dsn
+        self.reconnect_delay = reconnect_delay
+        self.ping_interval = ping_interval
+        self._queues = {}
+        self._task = None
+
+    def start(self):
+        """Starts the listener task once; safe to call on every stream."""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        delay = self.reconnect_delay
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(self.dsn, statement_cache_size=0)
+                closed = asyncio.Event()
+                connection.add_termination_listener(lambda _: closed.set())
+                await connection.add_listener(ORDER_STATUS_CHANNEL, self._dispatch)
+                delay = self.reconnect_delay
+                # Changes made before LISTEN took effect were not announced
+                self._broadcast(RESYNC)
+                while not closed.is_set():
+                    try:
+                        await asyncio.wait_for(closed.wait(), self.ping_interval)
+                    except asyncio.TimeoutError:
+                        # Nothing for a while: make sure the connection is still alive
+                        await connection.execute('SELECT 1')
+                raise Exception("LISTEN connection closed")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Order status feed disconnected, reconnecting in %.0fs: %s", delay, e)
+            finally:
+                if connection is not None and not connection.is_closed():
+                    await connection.close()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30.0)
+
+    def _dispatch(self, connection, pid, channel, payload):
+        order_id, _, status = payload.partition(':')
+        try:
+            order_id = int(order_id)
+        except ValueError:
+            return
+        for queue in self._queues.get(order_id, ()):
+            queue.put_nowait(status)
+
+    def _broadcast(self, message):
+        for queues in self._queues.values():
+            for queue in queues:
+                queue.put_nowait(message)
+
+    def watch(self, order_id):
+        """Queue of the order's status changes; call before reading the current
+        status so a change committed in between is not lost."""
+        queue = asyncio.Queue()
+        self._queues.setdefault(order_id, set()).add(queue)
+        return queue
+
+    def unwatch(self, order_id, queue):
+        queues = self._queues.get(order_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._queues[order_id]
+
+    def stats(self):
+        return {
+            'listening': self._task is not None and not self._task.done(),
+            'waiting': sum(len(queues) for queues in self._queues.values()),
+            'orders': len(self._queues),
+        }
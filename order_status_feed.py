@@ -0,0 +1,144 @@
+# order_status_feed.py
+import json
+import time
+import select
+import logging
+import threading
+
+import psycopg2
+from psycopg2 import extensions
+
+from webhook_events import ORDER_STATUS_CHANNEL, status_rank
+
+logger = logging.getLogger(__name__)
+
+# Returned by wait() when notifications may have been missed (the LISTEN
+# connection was re-established): the caller should re-read the order
+RESYNC = 'resync'
+
+
+def status_event(status):
+    """Server-Sent Event carrying the order status."""
+    return f"event: status\ndata: {json.dumps({'status': status})}\n\n"
+
+
+def retry_field(seconds):
+    """Tells the browser's EventSource how long to wait before reconnecting."""
+    return f"retry: {seconds * 1000}\n\n"
+
+
+class OrderStatusFeed:
+    """Order status changes pushed by Postgres NOTIFY to every waiting request.
+
+    One dedicated LISTEN connection per process, outside the pool, no matter
+    how many buyers are watching their orders. Only forward transitions
+    (see webhook_events.ORDER_STATUSES) are reported.
+    """
+
+    def __init__(self, dsn, reconnect_delay=1.0, ping_interval=60.0):
+        self.dsn = dsn
+        self.reconnect_delay = reconnect_delay
+        self.ping_interval = ping_interval
+        self._cond = threading.Condition()
+        self._statuses = {}
+        self._waiting = {}
+        self._generation = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Starts the listener thread once; safe to call on every request."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='order-status-feed', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        delay = self.reconnect_delay
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn)
+                conn.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cursor:
+                    cursor.execute(f'LISTEN {ORDER_STATUS_CHANNEL}')
+                delay = self.reconnect_delay
+                # Changes made before LISTEN took effect were not announced
+                self._resync()
+                self._listen(conn)
+            except Exception as e:
+                logger.warning("Order status feed disconnected, reconnecting in %.0fs: %s", delay, e)
+            finally:
+                if conn is not None:
+                    conn.close()
+            time.sleep(delay)
+            delay = min(delay * 2, 30.0)
+
+    def _listen(self, conn):
+        while True:
+            if select.select([conn], [], [], self.ping_interval) == ([], [], []):
+                # Nothing for a while: make sure the connection is still alive
+                with conn.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+                continue
+            conn.poll()
+            if conn.notifies:
+                self._dispatch(conn.notifies)
+                conn.notifies.clear()
+
+    def _dispatch(self, notifies):
+        with self._cond:
+            for notify in notifies:
+                order_id, _, status = notify.payload.partition(':')
+                try:
+                    order_id = int(order_id)
+                except ValueError:
+                    continue
+                if order_id in self._waiting and status_rank(status) > status_rank(self._statuses.get(order_id)):
+                    self._statuses[order_id] = status
+            self._cond.notify_all()
+
+    def _resync(self):
+        with self._cond:
+            self._generation += 1
+            self._cond.notify_all()
+
+    def watch(self, order_id):
+        """Starts keeping the order's status changes; call before reading the
+        current status so a change committed in between is not lost."""
+        with self._cond:
+            self._waiting[order_id] = self._waiting.get(order_id, 0) + 1
+
+    def unwatch(self, order_id):
+        with self._cond:
+            self._waiting[order_id] -= 1
+            if not self._waiting[order_id]:
+                del self._waiting[order_id]
+                self._statuses.pop(order_id, None)
+
+    def wait(self, order_id, status, timeout):
+        """Blocks until the watched order moves past `status`.
+
+        Returns the new status, RESYNC, or None if nothing happened within
+        `timeout` seconds.
+        """
+        with self._cond:
+            generation = self._generation
+            changed = self._cond.wait_for(
+                lambda: self._generation != generation
+                or status_rank(self._statuses.get(order_id)) > status_rank(status),
+                timeout,
+            )
+            if not changed:
+                return None
+            if self._generation != generation:
+                return RESYNC
+            return self._statuses[order_id]
+
+    def stats(self):
+        with self._cond:
+            return {
+                'listening': self._thread is not None and self._thread.is_alive(),
+                'waiting': sum(self._waiting.values()),
+                'orders': len(self._waiting),
+            }
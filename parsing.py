@@ -1,19 +1,39 @@
 from dotenv import load_dotenv
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, FeatureNotFound, SoupStrainer
 import psycopg2
+from psycopg2.extras import execute_values
 import json
 import re
 import os
 from datetime import datetime
+from catalog_search import build_search_text
+from catalog_similar import compute_similar
+from catalog_snapshot import derived_fields
 
 load_dotenv()
 
+# Движки разбора каталога: 'html' - полное дерево html.parser (с отладочной копией),
+# 'fast' - lxml, в дерево попадают только карточки товаров (div.card)
+PARSER_ENGINES = ('html', 'fast')
+
+
+def _is_card_class(value):
+    """class содержит 'card' (значение приходит строкой или списком классов)"""
+    if not value:
+        return False
+    classes = value.split() if isinstance(value, str) else value
+    return 'card' in classes
+
+
 class IPhoneCatalogParser:
-    def __init__(self):
+    def __init__(self, engine=None):
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
         }
+        self.engine = engine or os.environ.get('CATALOG_PARSER', 'html')
+        if self.engine not in PARSER_ENGINES:
+            raise ValueError(f"Unknown catalog parser engine: {self.engine}")
     
     def parse_catalog_html(self, html_content):
         """Парсинг HTML страницы каталога iPhone"""
@@ -23,12 +43,7 @@ class IPhoneCatalogParser:
             print("❌ HTML слишком короткий или пустой")
             return {'success': False, 'error': 'Empty HTML'}
         
-        soup = BeautifulSoup(html_content, 'html.parser')
-        
-        # Сохраним HTML для отладки
-        with open('debug_catalog.html', 'w', encoding='utf-8') as f:
-            f.write(soup.prettify())
-        print("💾 Каталог HTML сохранен в debug_catalog.html")
+        soup = self._make_soup(html_content)
         
         # Ищем все карточки товаров
         products = self._extract_products(soup)
@@ -43,6 +58,23 @@ class IPhoneCatalogParser:
         print(f"📊 Найдено товаров: {len(products)}")
         return result
     
+    def _make_soup(self, html_content):
+        """Дерево страницы для выбранного движка"""
+        if self.engine == 'fast':
+            try:
+                # Остальная страница (меню, скрипты, фильтры) в дерево не попадает
+                return BeautifulSoup(html_content, 'lxml', parse_only=SoupStrainer('div', class_=_is_card_class))
+            except FeatureNotFound:
+                print("⚠️ lxml не установлен, используем html.parser")
+
+        soup = BeautifulSoup(html_content, 'html.parser')
+        
+        # Сохраним HTML для отладки
+        with open('debug_catalog.html', 'w', encoding='utf-8') as f:
+            f.write(soup.prettify())
+        print("💾 Каталог HTML сохранен в debug_catalog.html")
+        return soup
+    
     def _extract_products(self, soup):
         """Извлечение всех товаров из каталога"""
         print("🔍 Ищем карточки товаров...")
@@ -183,11 +215,27 @@ class iPhoneDatabase:
         saved_count = 0
         try:
             for product in catalog_data.get('products', []):
+                # Сырые поля в том виде, в каком они лежат в iphones_catalog
+                row = {
+                    'model': product.get('model'),
+                    'price': product.get('numeric_price'),
+                    'current_color': product.get('current_color'),
+                    'colors': list(dict.fromkeys(product.get('available_colors', []))),
+                    'current_memory': product.get('current_memory'),
+                    'memory_sizes': list(dict.fromkeys(product.get('memory_options', []))),
+                    'current_sim': product.get('current_sim'),
+                    'sim_options': list(dict.fromkeys(product.get('sim_options', []))),
+                }
+                # Поля для отображения считаем один раз здесь, а не при каждом чтении
+                display = derived_fields(row)
+
                 cursor.execute('''
                     INSERT INTO iphones_catalog 
                     (product_id, model, price, currency, old_price, current_color, 
-                     current_memory, current_sim, image_url, product_url, parsed_at)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                     current_memory, current_sim, image_url, product_url, parsed_at,
+                     colors, memory_sizes, sim_options, search_text,
+                     formatted_price, short_model, colors_list, memory_list, all_colors, all_memory)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
                     ON CONFLICT (product_id) DO UPDATE SET
                         model = EXCLUDED.model,
                         price = EXCLUDED.price,
@@ -198,19 +246,39 @@ class iPhoneDatabase:
                         current_sim = EXCLUDED.current_sim,
                         image_url = EXCLUDED.image_url,
                         product_url = EXCLUDED.product_url,
-                        parsed_at = EXCLUDED.parsed_at
+                        parsed_at = EXCLUDED.parsed_at,
+                        colors = EXCLUDED.colors,
+                        memory_sizes = EXCLUDED.memory_sizes,
+                        sim_options = EXCLUDED.sim_options,
+                        search_text = EXCLUDED.search_text,
+                        formatted_price = EXCLUDED.formatted_price,
+                        short_model = EXCLUDED.short_model,
+                        colors_list = EXCLUDED.colors_list,
+                        memory_list = EXCLUDED.memory_list,
+                        all_colors = EXCLUDED.all_colors,
+                        all_memory = EXCLUDED.all_memory
                 ''', (
                     product.get('product_id'),
-                    product.get('model'),
-                    product.get('numeric_price'),
+                    row['model'],
+                    row['price'],
                     'RUB',
                     product.get('old_price'),
-                    product.get('current_color'),
-                    product.get('current_memory'),
-                    product.get('current_sim'),
+                    row['current_color'],
+                    row['current_memory'],
+                    row['current_sim'],
                     product.get('image_url'),
                     product.get('product_url'),
-                    catalog_data.get('parsed_at')
+                    catalog_data.get('parsed_at'),
+                    row['colors'],
+                    row['memory_sizes'],
+                    row['sim_options'],
+                    build_search_text(row),
+                    display['formatted_price'],
+                    display['short_model'],
+                    display['colors_list'],
+                    display['memory_list'],
+                    display['all_colors'],
+                    display['all_memory'],
                 ))
                 
                 product_id = product.get('product_id')
@@ -227,7 +295,33 @@ class iPhoneDatabase:
                 
                 saved_count += 1
             
+            # Похожие товары для страницы товара считаем по всему каталогу
+            self._save_similar(cursor)
+
+            # Новая версия каталога вместе со счетчиками товаров:
+            # воркеры увидят ее и перечитают снимок
+            cursor.execute('''
+                WITH counts AS (
+                    SELECT category, COUNT(*) AS cnt
+                    FROM iphones_catalog
+                    GROUP BY category
+                )
+                INSERT INTO catalog_meta (id, version, product_count, category_counts, updated_at)
+                SELECT 1, 1,
+                       COALESCE((SELECT SUM(cnt) FROM counts), 0),
+                       COALESCE((SELECT jsonb_object_agg(category, cnt) FROM counts WHERE category IS NOT NULL), '{}'),
+                       CURRENT_TIMESTAMP
+                ON CONFLICT (id) DO UPDATE SET
+                    version = catalog_meta.version + 1,
+                    product_count = EXCLUDED.product_count,
+                    category_counts = EXCLUDED.category_counts,
+                    updated_at = CURRENT_TIMESTAMP
+                RETURNING version
+            ''')
+            catalog_version = cursor.fetchone()[0]
+            
             conn.commit()
+            print(f"🔖 Версия каталога: {catalog_version}")
             print(f"💾 Сохранено товаров: {saved_count}")
             return True
             
@@ -237,9 +331,22 @@ class iPhoneDatabase:
         finally:
             conn.close()
 
-def main_catalog():
-    """Основная функция для парсинга каталога"""
-    parser = IPhoneCatalogParser()
+    def _save_similar(self, cursor):
+        """Пересчет похожих товаров (similar_ids) для всех товаров каталога"""
+        cursor.execute('SELECT product_id, model, category, price, memory_sizes FROM iphones_catalog')
+        columns = [column[0] for column in cursor.description]
+        products = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        similar = compute_similar(products)
+        if similar:
+            execute_values(cursor, '''
+                UPDATE iphones_catalog AS ic SET similar_ids = v.similar_ids
+                FROM (VALUES %s) AS v (product_id, similar_ids)
+                WHERE ic.product_id = v.product_id
+            ''', list(similar.items()), template='(%s, %s::text[])')
+
+def main_catalog(engine=None):
+    """Основная функция для парсинга каталога (engine - см. PARSER_ENGINES, по умолчанию CATALOG_PARSER)"""
+    parser = IPhoneCatalogParser(engine)
     db_url = os.environ.get('DATABASE_URL')
     if not db_url:
         raise Exception("DATABASE_URL environment variable not set")
@@ -252,7 +359,7 @@ def main_catalog():
         print(f"📁 HTML загружен из файла, размер: {len(catalog_html)} символов")
     except FileNotFoundError:
         print("❌ Файл site-html.txt не найден")
-        return
+        return False
     
     print("=== ПАРСИНГ КАТАЛОГА IPHONE ===")
     
@@ -274,11 +381,36 @@ def main_catalog():
         # Сохраняем в базу
         if db.save_catalog(result):
             print(f"\n💾 Весь каталог сохранен в базу данных")
-        else:
-            print("❌ Ошибка сохранения каталога в базу")
+            return True
+        print("❌ Ошибка сохранения каталога в базу")
     else:
         print("❌ Ошибка парсинга каталога")
+    return False
+
+def compare_engines(html_content):
+    """Разбирает страницу обоими движками; возвращает product_id товаров, которые отличаются"""
+    results = {
+        engine: IPhoneCatalogParser(engine).parse_catalog_html(html_content).get('products', [])
+        for engine in PARSER_ENGINES
+    }
+    html_products, fast_products = results['html'], results['fast']
+    differ = [a.get('product_id') for a, b in zip(html_products, fast_products) if a != b]
+    if len(html_products) != len(fast_products):
+        differ.append(f"count: {len(html_products)} != {len(fast_products)}")
+    return differ
 
 if __name__ == "__main__":
-    # Запускаем парсинг каталога
-    main_catalog()
+    import argparse
+
+    arg_parser = argparse.ArgumentParser(description="Парсинг каталога из site-html.txt в базу")
+    arg_parser.add_argument('--engine', choices=PARSER_ENGINES, help="по умолчанию CATALOG_PARSER или html")
+    arg_parser.add_argument('--compare', action='store_true', help="только сравнить результаты движков, без записи в базу")
+    args = arg_parser.parse_args()
+
+    if args.compare:
+        with open('site-html.txt', 'r', encoding='utf-8') as f:
+            differ = compare_engines(f.read())
+        print("✅ Движки дают одинаковые товары" if not differ else f"❌ Отличаются: {differ}")
+    else:
+        # Запускаем парсинг каталога
+        main_catalog(args.engine)
@@ -0,0 +1,124 @@
+# payments.py
+import json
+
+# Shared by the Flask payment routes (app.py) and the async ones (asgi.py).
+# The order id is reserved up front (the charge needs it for metadata and the
+# redirect URL) and the order is written once, together with its charge code,
+# after the charge exists: no connection is held while Coinbase responds and
+# failed charges leave no orphaned 'new' orders behind.
+RESERVE_ORDER_ID_QUERY = "SELECT nextval(pg_get_serial_sequence('orders', 'id'))"
+
+# Prices the whole cart at current catalog prices, with the cart total
+PRICE_CART_QUERY = '''
+    SELECT ic.product_id, ic.model, ic.price, cart.quantity,
+           ic.price * cart.quantity AS total_price,
+           SUM(ic.price * cart.quantity) OVER () AS cart_total
+    FROM unnest(%s::text[], %s::int[]) AS cart(product_id, quantity)
+    JOIN iphones_catalog ic ON ic.product_id = cart.product_id
+    WHERE cart.quantity > 0
+    ORDER BY ic.model, ic.product_id
+'''
+
+# The order and all of its lines in one statement (and so one transaction).
+# orders.product_id keeps the comma-separated ids for older readers.
+SAVE_ORDER_QUERY = '''
+    WITH new_order AS (
+        INSERT INTO orders (id, product_id, price, status, charge_code)
+        VALUES (%s, %s, %s, 'pending', %s)
+        RETURNING id
+    )
+    INSERT INTO order_items (order_id, product_id, model, price, quantity)
+    SELECT new_order.id, item.product_id, item.model, item.price, item.quantity
+    FROM new_order, unnest(%s::text[], %s::text[], %s::int[], %s::int[])
+        AS item(product_id, model, price, quantity)
+'''
+
+
+def asyncpg_query(query):
+    """The same statement with asyncpg's numbered placeholders ($1, $2, ...) instead of %s."""
+    parts = query.split('%s')
+    return parts[0] + ''.join(f'${number}{part}' for number, part in enumerate(parts[1:], 1))
+
+
+def price_cart(cursor, cart):
+    """Cart lines at current prices and the cart total, in one query.
+
+    `cart` maps product_id to quantity; unknown products are left out.
+    """
+    product_ids = list(cart)
+    cursor.execute(PRICE_CART_QUERY, (product_ids, [int(cart[product_id]) for product_id in product_ids]))
+    rows = cursor.fetchall()
+    lines = [
+        {'product_id': product_id, 'model': model, 'price': price, 'quantity': quantity, 'total_price': total_price}
+        for product_id, model, price, quantity, total_price, _ in rows
+    ]
+    return lines, (rows[0][5] if rows else 0)
+
+
+def product_line(product):
+    """A single product as an order line."""
+    return {
+        'product_id': product['product_id'],
+        'model': product['model'],
+        'price': product['price'],
+        'quantity': 1,
+        'total_price': product['price'],
+    }
+
+
+def order_params(order_id, lines, total_price, charge_code):
+    """Parameters for SAVE_ORDER_QUERY."""
+    return (
+        order_id,
+        ",".join(line['product_id'] for line in lines),
+        total_price,
+        charge_code,
+        [line['product_id'] for line in lines],
+        [line['model'] for line in lines],
+        [line['price'] for line in lines],
+        [line['quantity'] for line in lines],
+    )
+
+
+def save_order(cursor, order_id, lines, total_price, charge_code):
+    """Writes the order with its lines (one bulk insert)."""
+    cursor.execute(SAVE_ORDER_QUERY, order_params(order_id, lines, total_price, charge_code))
+
+
+def product_charge_info(product, order_id, redirect_url, cancel_url):
+    """Coinbase Commerce charge for a single product."""
+    return {
+        'name': product['model'],
+        'description': f"Order #{order_id}",
+        'local_price': {
+            'amount': str(product['price']),
+            'currency': 'RUB'
+        },
+        'pricing_type': 'fixed_price',
+        'metadata': {
+            'order_id': order_id,
+            'product_id': product['product_id']
+        },
+        'redirect_url': redirect_url,
+        'cancel_url': cancel_url,
+    }
+
+
+def cart_charge_info(cart_products, cart, order_id, total_price, redirect_url, cancel_url):
+    """Coinbase Commerce charge for the whole cart."""
+    item_descriptions = [f"{product['model']} (x{product['quantity']})" for product in cart_products]
+    return {
+        'name': f'Your Order #{order_id} from TonStore',
+        'description': ", ".join(item_descriptions),
+        'local_price': {
+            'amount': str(total_price),
+            'currency': 'RUB'
+        },
+        'pricing_type': 'fixed_price',
+        'metadata': {
+            'order_id': order_id,
+            'cart_items': json.dumps(cart)
+        },
+        'redirect_url': redirect_url,
+        'cancel_url': cancel_url,
+    }
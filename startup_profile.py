@@ -0,0 +1,97 @@
+# startup_profile.py
+"""Cold-start benchmark: time to import the app and run create_app().
+
+Each run is a fresh interpreter started with `-X importtime`, like a new
+serverless instance. Prints the median startup time, what the module
+imports two levels deep (cumulative time) and the modules with the highest
+self time anywhere in the import tree, from the last run.
+
+    python startup_profile.py                  # MINIMAL_STARTUP=1
+    python startup_profile.py --mode full      # with the startup schema check
+    python startup_profile.py --runs 10 --top 25
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+STARTUP_SNIPPET = '''
+import time
+started = time.perf_counter()
+import {module}
+print("STARTUP", time.perf_counter() - started)
+'''
+
+
+def run_once(module, env):
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', STARTUP_SNIPPET.format(module=module)],
+        env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise SystemExit(f"Startup failed:\n{result.stderr[-2000:]}")
+    seconds = next(float(line.split()[1]) for line in result.stdout.splitlines() if line.startswith('STARTUP '))
+    return seconds, parse_importtime(result.stderr)
+
+
+def parse_importtime(stderr):
+    """Import tree from -X importtime output: top-level (module, cumulative_us, self_us, children) nodes."""
+    # Lines come in post-order: a module is printed after everything it imported,
+    # indented two spaces per nesting level
+    pending = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        node = (name.strip(), int(cumulative_us), int(self_us), pending.pop(depth + 1, []))
+        pending.setdefault(depth, []).append(node)
+    return pending.get(0, [])
+
+
+def walk(nodes):
+    """Every node of the import tree."""
+    for node in nodes:
+        yield node
+        yield from walk(node[3])
+
+
+def print_report(module, imports, top):
+    """Imports made by `module` two levels deep, then the slowest modules by self time."""
+    children = next((node[3] for node in imports if node[0] == module), [])
+    print(f"\nImported by {module} (two levels, cumulative ms / self ms):")
+    for name, cumulative, self_us, grandchildren in sorted(children, key=lambda node: -node[1])[:top]:
+        print(f"{cumulative / 1000:>10.1f} {self_us / 1000:>8.1f}  {name}")
+        for name, cumulative, self_us, _ in sorted(grandchildren, key=lambda node: -node[1])[:top]:
+            print(f"{cumulative / 1000:>10.1f} {self_us / 1000:>8.1f}    {name}")
+
+    nodes = list(walk(imports))
+    print(f"\nSlowest of {len(nodes)} modules by self time (ms):")
+    for name, _, self_us, _ in sorted(nodes, key=lambda node: -node[2])[:top]:
+        print(f"{self_us / 1000:>10.1f}  {name}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure cold-start import time of the app.")
+    parser.add_argument('--module', default='wsgi', help="module whose import builds the app (default: wsgi)")
+    parser.add_argument('--mode', choices=('minimal', 'full'), default='minimal')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args(argv)
+
+    env = dict(os.environ, MINIMAL_STARTUP='1' if args.mode == 'minimal' else '0')
+    timings = []
+    imports = []
+    for _ in range(args.runs):
+        seconds, imports = run_once(args.module, env)
+        timings.append(seconds)
+
+    print(f"{args.module} startup ({args.mode}), {args.runs} runs: "
+          f"median {statistics.median(timings) * 1000:.1f} ms, "
+          f"min {min(timings) * 1000:.1f} ms, max {max(timings) * 1000:.1f} ms")
+    print_report(args.module, imports, args.top)
+
+
+if __name__ == '__main__':
+    main()
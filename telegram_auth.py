@@ -0,0 +1,32 @@
+# telegram_auth.py
+import hmac
+import json
+import time
+import hashlib
+from urllib.parse import parse_qsl
+
+
+def verify_init_data(init_data, bot_token, max_age=86400):
+    """Telegram user id from Telegram.WebApp.initData, or None if the signature is invalid.
+
+    https://core.telegram.org/bots/webapps#validating-data-received-via-the-mini-app
+    """
+    if not init_data or not bot_token:
+        return None
+    fields = dict(parse_qsl(init_data, keep_blank_values=True))
+    received_hash = fields.pop('hash', None)
+    if not received_hash:
+        return None
+
+    data_check_string = '\n'.join(f'{key}={value}' for key, value in sorted(fields.items()))
+    secret_key = hmac.new(b'WebAppData', bot_token.encode('utf-8'), hashlib.sha256).digest()
+    expected_hash = hmac.new(secret_key, data_check_string.encode('utf-8'), hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(expected_hash, received_hash):
+        return None
+
+    try:
+        if max_age and time.time() - int(fields.get('auth_date', 0)) > max_age:
+            return None
+        return int(json.loads(fields.get('user', '{}'))['id'])
+    except (KeyError, TypeError, ValueError):
+        return None
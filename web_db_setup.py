@@ -1,6 +1,7 @@
 # web_db_setup.py
 from dotenv import load_dotenv
 import psycopg2
+from psycopg2.extras import execute_values
 import os
 import logging
 
@@ -8,6 +9,60 @@ load_dotenv()
 
 logging.basicConfig(level=logging.INFO)
 
+# Bump together with any change to setup_database(); the app refuses to
+# trust a database whose schema_version differs (see check_schema_version)
+SCHEMA_VERSION = 7
+
+
+def get_schema_version(cursor):
+    """Schema version recorded by the last migration, or None if never migrated."""
+    cursor.execute("SELECT to_regclass('schema_version')")
+    if cursor.fetchone()[0] is None:
+        return None
+    cursor.execute("SELECT version FROM schema_version WHERE id = 1")
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def check_schema_version(cursor):
+    """Raises if the database was not migrated to this code's SCHEMA_VERSION."""
+    version = get_schema_version(cursor)
+    if version != SCHEMA_VERSION:
+        raise Exception(
+            f"Database schema version is {version}, expected {SCHEMA_VERSION}; run `python migrate.py`"
+        )
+    return version
+
+
+def backfill_display_fields(cursor):
+    """Brings display fields in line with the raw columns, with the same values
+    save_catalog() stores: fills rows saved before those columns existed and
+    recomputes rows whose colors/memory_sizes were backfilled since. Returns
+    the number of rows updated."""
+    from catalog_snapshot import DERIVED_FIELDS, derived_fields
+
+    cursor.execute(f'''
+        SELECT product_id, model, price, current_color, colors, current_memory, memory_sizes,
+               {', '.join(DERIVED_FIELDS)}
+        FROM iphones_catalog
+    ''')
+    columns = [column[0] for column in cursor.description]
+    rows = []
+    for row in cursor.fetchall():
+        product = dict(zip(columns, row))
+        fields = derived_fields(product)
+        if all(product[field] == fields[field] for field in DERIVED_FIELDS):
+            continue
+        rows.append((product['product_id'],) + tuple(fields[field] for field in DERIVED_FIELDS))
+    if rows:
+        execute_values(cursor, f'''
+            UPDATE iphones_catalog AS ic SET {', '.join(f'{field} = v.{field}' for field in DERIVED_FIELDS)}
+            FROM (VALUES %s) AS v (product_id, {', '.join(DERIVED_FIELDS)})
+            WHERE ic.product_id = v.product_id
+        ''', rows, template='(%s, %s, %s, %s::text[], %s::text[], %s, %s)')
+    return len(rows)
+
+
 def setup_database():
     logging.info("Starting database setup...")
     try:
@@ -41,6 +96,37 @@ def setup_database():
             )
         ''')
         logging.info("iphones_catalog table created or already exists.")
+
+        # Denormalized variant arrays, maintained by parsing.save_catalog
+        cursor.execute("ALTER TABLE iphones_catalog ADD COLUMN IF NOT EXISTS colors TEXT[]")
+        cursor.execute("ALTER TABLE iphones_catalog ADD COLUMN IF NOT EXISTS memory_sizes TEXT[]")
+        cursor.execute("ALTER TABLE iphones_catalog ADD COLUMN IF NOT EXISTS sim_options TEXT[]")
+        # Precomputed neighbours for the product page (catalog_similar.compute_similar)
+        cursor.execute("ALTER TABLE iphones_catalog ADD COLUMN IF NOT EXISTS similar_ids TEXT[]")
+        # Display fields (catalog_snapshot.derived_fields), computed once at ingest;
+        # rows saved before these columns existed are filled in right here
+        cursor.execute("ALTER TABLE iphones_catalog ADD COLUMN IF NOT EXISTS formatted_price TEXT")
+        cursor.execute("ALTER TABLE iphones_catalog ADD COLUMN IF NOT EXISTS short_model TEXT")
+        cursor.execute("ALTER TABLE iphones_catalog ADD COLUMN IF NOT EXISTS colors_list TEXT[]")
+        cursor.execute("ALTER TABLE iphones_catalog ADD COLUMN IF NOT EXISTS memory_list TEXT[]")
+        cursor.execute("ALTER TABLE iphones_catalog ADD COLUMN IF NOT EXISTS all_colors TEXT")
+        cursor.execute("ALTER TABLE iphones_catalog ADD COLUMN IF NOT EXISTS all_memory TEXT")
+
+        # Indexes matching the keyset pagination orders (catalog_pagination.SORT_ORDERS)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_iphones_catalog_price_asc ON iphones_catalog (price ASC, id ASC)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_iphones_catalog_price_desc ON iphones_catalog (price DESC, id ASC)")
+        # sort=name compares model in the database collation; replaces the old COLLATE "C" index
+        cursor.execute("DROP INDEX IF EXISTS idx_iphones_catalog_name")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_iphones_catalog_model ON iphones_catalog (model, id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_iphones_catalog_display_order ON iphones_catalog (display_order, id)")
+
+        # Normalized search text (catalog_search.build_search_text) with a trigram index
+        cursor.execute("ALTER TABLE iphones_catalog ADD COLUMN IF NOT EXISTS search_text TEXT")
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_iphones_catalog_search_text
+            ON iphones_catalog USING GIN (search_text gin_trgm_ops)
+        ''')
         
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS iphone_catalog_colors (
@@ -60,6 +146,46 @@ def setup_database():
         ''')
         logging.info("iphone_catalog_memory table created or already exists.")
 
+        # Backfill the arrays for rows ingested before they existed
+        cursor.execute('''
+            UPDATE iphones_catalog ic SET colors = agg.colors
+            FROM (
+                SELECT product_id, ARRAY_AGG(DISTINCT color_name ORDER BY color_name) AS colors
+                FROM iphone_catalog_colors GROUP BY product_id
+            ) agg
+            WHERE ic.product_id = agg.product_id AND ic.colors IS NULL
+        ''')
+        cursor.execute('''
+            UPDATE iphones_catalog ic SET memory_sizes = agg.memory_sizes
+            FROM (
+                SELECT product_id, ARRAY_AGG(DISTINCT memory_size ORDER BY memory_size) AS memory_sizes
+                FROM iphone_catalog_memory GROUP BY product_id
+            ) agg
+            WHERE ic.product_id = agg.product_id AND ic.memory_sizes IS NULL
+        ''')
+
+        # Display fields are derived from the arrays, so they are checked after them
+        backfilled = backfill_display_fields(cursor)
+        if backfilled:
+            logging.info(f"Display fields updated for {backfilled} products.")
+
+        # Catalog version, bumped by every catalog ingest (see parsing.save_catalog)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS catalog_meta (
+                id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+                version BIGINT NOT NULL DEFAULT 0,
+                product_count INTEGER NOT NULL DEFAULT 0,
+                category_counts JSONB NOT NULL DEFAULT '{}',
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute("ALTER TABLE catalog_meta ADD COLUMN IF NOT EXISTS product_count INTEGER NOT NULL DEFAULT 0")
+        cursor.execute("ALTER TABLE catalog_meta ADD COLUMN IF NOT EXISTS category_counts JSONB NOT NULL DEFAULT '{}'")
+        # Hash of the ingested site-html.txt, lets migrate.py skip an unchanged catalog
+        cursor.execute("ALTER TABLE catalog_meta ADD COLUMN IF NOT EXISTS source_hash TEXT")
+        cursor.execute('INSERT INTO catalog_meta (id, version) VALUES (1, 0) ON CONFLICT (id) DO NOTHING')
+        logging.info("catalog_meta table created or already exists.")
+
         # New table for orders
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS orders (
@@ -72,6 +198,78 @@ def setup_database():
             )
         ''')
         logging.info("orders table created or already exists.")
+
+        # Order lines, written with the order in one statement (see payments.save_order)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS order_items (
+                id SERIAL PRIMARY KEY,
+                order_id INTEGER NOT NULL REFERENCES orders (id) ON DELETE CASCADE,
+                product_id TEXT NOT NULL,
+                model TEXT,
+                price INTEGER NOT NULL,
+                quantity INTEGER NOT NULL CHECK (quantity > 0)
+            )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_order_items_order_id ON order_items (order_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_order_items_product_id ON order_items (product_id)")
+        logging.info("order_items table created or already exists.")
+
+        # Processed Coinbase webhook events, deduplicated by event id (see webhook_events.py)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS coinbase_events (
+                event_id TEXT PRIMARY KEY,
+                event_type TEXT NOT NULL,
+                order_id INTEGER,
+                status TEXT,
+                received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        logging.info("coinbase_events table created or already exists.")
+
+        # Verified webhook events waiting for the workers (see webhook_queue.py)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS webhook_queue (
+                id BIGSERIAL PRIMARY KEY,
+                event_id TEXT UNIQUE NOT NULL,
+                payload JSONB NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                dead BOOLEAN NOT NULL DEFAULT FALSE,
+                last_error TEXT,
+                available_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_webhook_queue_available
+            ON webhook_queue (available_at, id) WHERE NOT dead
+        ''')
+        logging.info("webhook_queue table created or already exists.")
+
+        # Server-side carts keyed by session token or Telegram user (see cart_store.py)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS carts (
+                cart_key TEXT PRIMARY KEY,
+                items JSONB NOT NULL DEFAULT '{}',
+                item_count INTEGER NOT NULL DEFAULT 0,
+                total_price INTEGER,
+                priced_version BIGINT,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        logging.info("carts table created or already exists.")
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+                version INTEGER NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('''
+            INSERT INTO schema_version (id, version, applied_at) VALUES (1, %s, CURRENT_TIMESTAMP)
+            ON CONFLICT (id) DO UPDATE SET version = EXCLUDED.version, applied_at = EXCLUDED.applied_at
+        ''', (SCHEMA_VERSION,))
+        logging.info(f"Schema version set to {SCHEMA_VERSION}.")
         
         conn.commit()
         conn.close()
@@ -0,0 +1,76 @@
+# webhook_events.py
+from psycopg2.extras import execute_values
+
+# Order statuses in the only direction they may move. A late or replayed
+# charge:failed cannot undo 'paid'; a late charge:confirmed still wins over 'failed'.
+ORDER_STATUSES = ('new', 'pending', 'failed', 'paid')
+
+# Coinbase Commerce event type -> order status it moves the order to
+EVENT_STATUSES = {
+    'charge:confirmed': 'paid',
+    'charge:failed': 'failed',
+}
+
+_RANKS = "ARRAY[" + ", ".join(f"'{status}'" for status in ORDER_STATUSES) + "]"
+
+# Channel announcing '<order_id>:<status>' for every order status change;
+# delivered on commit (see order_status_feed.py)
+ORDER_STATUS_CHANNEL = 'order_status'
+
+# One statement per batch: record the events (duplicates are dropped by the
+# primary key), then move each order once, to the furthest status among its
+# new events, and only forward.
+APPLY_EVENTS_QUERY = f'''
+    WITH fresh AS (
+        INSERT INTO coinbase_events (event_id, event_type, order_id, status)
+        VALUES %s
+        ON CONFLICT (event_id) DO NOTHING
+        RETURNING order_id, status
+    ), target AS (
+        SELECT DISTINCT ON (order_id) order_id, status
+        FROM fresh
+        WHERE order_id IS NOT NULL AND status IS NOT NULL
+        ORDER BY order_id, array_position({_RANKS}, status) DESC
+    ), updated AS (
+        UPDATE orders o SET status = target.status
+        FROM target
+        WHERE o.id = target.order_id
+          AND COALESCE(array_position({_RANKS}, o.status), 0) < array_position({_RANKS}, target.status)
+        RETURNING o.id, o.status
+    )
+    SELECT id, status, pg_notify('{ORDER_STATUS_CHANNEL}', id || ':' || status) FROM updated
+'''
+
+
+def event_row(event):
+    """(event_id, event_type, order_id, status) for a verified Coinbase event."""
+    metadata = (event.get('data') or {}).get('metadata') or {}
+    try:
+        order_id = int(metadata.get('order_id'))
+    except (TypeError, ValueError):
+        order_id = None
+    return (event['id'], event['type'], order_id, EVENT_STATUSES.get(event['type']))
+
+
+def apply_events(cursor, events):
+    """Records a batch of webhook events and applies them to their orders.
+
+    Returns (order_id, status) for each order that actually changed; events
+    seen before and transitions that would move an order backwards are no-ops.
+    """
+    rows = [event_row(event) for event in events]
+    if not rows:
+        return []
+    changed = execute_values(
+        cursor, APPLY_EVENTS_QUERY, rows,
+        template='(%s, %s, %s::integer, %s)', page_size=len(rows), fetch=True,
+    )
+    return [(order_id, status) for order_id, status, _ in changed]
+
+
+def status_rank(status):
+    """Position of an order status in ORDER_STATUSES (-1 for unknown ones)."""
+    try:
+        return ORDER_STATUSES.index(status)
+    except ValueError:
+        return -1
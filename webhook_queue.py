@@ -0,0 +1,205 @@
+# webhook_queue.py
+"""Postgres-backed queue for verified Coinbase webhook events.
+
+The webhook endpoint only verifies the signature and enqueues the event;
+WebhookWorkerPool drains the queue in batches (webhook_events.apply_events),
+retrying failed events with exponential backoff. Workers run as threads in
+the web process (WEBHOOK_WORKERS) or as a separate process:
+
+    python webhook_queue.py
+"""
+import os
+import time
+import random
+import logging
+import threading
+
+from psycopg2.extras import Json
+
+from webhook_events import apply_events
+
+logger = logging.getLogger(__name__)
+
+ENQUEUE_QUERY = '''
+    INSERT INTO webhook_queue (event_id, payload) VALUES (%s, %s)
+    ON CONFLICT (event_id) DO NOTHING
+'''
+
+# SKIP LOCKED lets any number of workers drain the queue without blocking
+# each other; rows stay locked until the batch transaction ends
+CLAIM_QUERY = '''
+    SELECT id, payload, attempts FROM webhook_queue
+    WHERE NOT dead AND available_at <= CURRENT_TIMESTAMP
+    ORDER BY id
+    LIMIT %s
+    FOR UPDATE SKIP LOCKED
+'''
+
+RETRY_QUERY = '''
+    UPDATE webhook_queue
+    SET attempts = %s, dead = %s, last_error = %s,
+        available_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 second'
+    WHERE id = %s
+'''
+
+
+def enqueue(cursor, event):
+    """Durably stores a verified event; a redelivered event id is dropped."""
+    cursor.execute(ENQUEUE_QUERY, (event['id'], Json(event)))
+
+
+def backoff(attempts, base=1.0, cap=300.0):
+    """Seconds before retry number `attempts`: exponential with jitter."""
+    delay = min(cap, base * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+class WebhookWorkerPool:
+    """Threads draining webhook_queue through the shared connection pool."""
+
+    def __init__(self, db_pool, workers=1, batch_size=100, poll_interval=1.0, max_attempts=10):
+        self.db_pool = db_pool
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._stats = {'batches': 0, 'processed': 0, 'retried': 0, 'dead': 0, 'errors': 0}
+
+    @classmethod
+    def from_env(cls, db_pool, workers=None):
+        return cls(
+            db_pool,
+            # Serverless functions are frozen between requests: no threads there
+            workers=int(os.environ.get('WEBHOOK_WORKERS', 0 if os.environ.get('VERCEL') else 1)) if workers is None else workers,
+            batch_size=int(os.environ.get('WEBHOOK_BATCH_SIZE', 100)),
+            poll_interval=float(os.environ.get('WEBHOOK_POLL_INTERVAL', 1)),
+            max_attempts=int(os.environ.get('WEBHOOK_MAX_ATTEMPTS', 10)),
+        )
+
+    def start(self):
+        """Starts the worker threads once; safe to call on every enqueue."""
+        with self._lock:
+            if self._threads or self.workers <= 0:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f'webhook-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        logger.info("Started %d webhook worker(s)", self.workers)
+
+    def notify(self):
+        """Wakes the workers up right after an enqueue instead of waiting for the next poll."""
+        self._wakeup.set()
+
+    def stop(self, timeout=5.0):
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _count(self, key, value=1):
+        with self._lock:
+            self._stats[key] += value
+
+    def _run(self):
+        errors = 0
+        while not self._stopping.is_set():
+            try:
+                processed = self.process_batch()
+                errors = 0
+            except Exception as e:
+                # Database unavailable: back off instead of spinning
+                errors += 1
+                self._count('errors')
+                delay = backoff(errors, base=self.poll_interval, cap=60.0)
+                logger.warning("Webhook worker error, retrying in %.1fs: %s", delay, e)
+                self._stopping.wait(delay)
+                continue
+            if processed < self.batch_size:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def process_batch(self):
+        """Claims and applies one batch; returns the number of events claimed."""
+        with self.db_pool.connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(CLAIM_QUERY, (self.batch_size,))
+                jobs = cursor.fetchall()
+                if not jobs:
+                    return 0
+
+                done, failed, changed = self._apply(cursor, jobs)
+
+                if done:
+                    cursor.execute('DELETE FROM webhook_queue WHERE id = ANY(%s)', (done,))
+                for job_id, attempts, error in failed:
+                    dead = attempts >= self.max_attempts
+                    cursor.execute(RETRY_QUERY, (attempts, dead, error, backoff(attempts), job_id))
+                    if dead:
+                        logger.error("Webhook event %s dropped after %d attempts: %s", job_id, attempts, error)
+                        self._count('dead')
+                    else:
+                        self._count('retried')
+
+        for order_id, status in changed:
+            logger.info("Order %s marked as %s", order_id, status)
+        self._count('batches')
+        self._count('processed', len(done))
+        return len(jobs)
+
+    def _apply(self, cursor, jobs):
+        """Applies the whole batch at once; if that fails, event by event to isolate the bad one."""
+        cursor.execute('SAVEPOINT webhook_batch')
+        try:
+            changed = apply_events(cursor, [payload for _, payload, _ in jobs])
+            return [job_id for job_id, _, _ in jobs], [], changed
+        except Exception:
+            cursor.execute('ROLLBACK TO SAVEPOINT webhook_batch')
+
+        done, failed, changed = [], [], []
+        for job_id, payload, attempts in jobs:
+            cursor.execute('SAVEPOINT webhook_event')
+            try:
+                changed.extend(apply_events(cursor, [payload]))
+                done.append(job_id)
+            except Exception as e:
+                cursor.execute('ROLLBACK TO SAVEPOINT webhook_event')
+                failed.append((job_id, attempts + 1, str(e)))
+        return done, failed, changed
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['workers'] = len(self._threads)
+        return stats
+
+
+def main(argv=None):
+    import argparse
+    from db_pool import ConnectionPool
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(description="Drain the Coinbase webhook queue.")
+    parser.add_argument('--workers', type=int, default=2)
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    db_pool = ConnectionPool.from_env()
+    pool = WebhookWorkerPool.from_env(db_pool, workers=args.workers)
+    pool.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pool.stop()
+        db_pool.closeall()
+
+
+if __name__ == '__main__':
+    main()